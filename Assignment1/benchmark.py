@@ -0,0 +1,231 @@
+from itertools import product
+from timeit import default_timer as timer
+
+import gurobipy as gb
+import numpy as np
+
+from models.ItemTable import ItemTable
+from questions import benders, knapsack_engines, part1, part5, solver_backends
+
+
+def time_call(function, *args):
+    start = timer()
+    result = function(*args)
+    return timer() - start, result
+
+
+def benchmark_knapsack_engines(item_counts=(10, 20, 30, 36, 60, 200, 1000), capacities=(440, 10 ** 4, 10 ** 6),
+                               seed=0, time_limit=5.0, max_nodes=10 ** 6):
+    """
+    Times the exact knapsack engines of knapsack_engines and prints one line per (instance type, n, capacity)
+    with the engine picked by select_knapsack_engine. Two instance types are used: part1-like instances
+    (revenue times size as value) and strongly correlated instances (value = size + capacity / 10), which are
+    the hard case for branch-and-bound. Sizes are scaled with the capacity, so that about half of the items fit.
+    Engines that were slower than time_limit for a smaller problem of the same type and capacity are skipped
+    and branch-and-bound is stopped after max_nodes nodes.
+    :param item_counts: the numbers of items
+    :param capacities: the capacities of the knapsack
+    :param seed: the seed of the random instances
+    :param time_limit: the time limit in seconds per engine
+    :param max_nodes: the node limit of branch-and-bound
+    """
+    rng = np.random.default_rng(seed)
+    engines = ["exact_dp", "branch_and_bound", "meet_in_the_middle"]
+    print("type\tn\tcapacity\t" + "\t".join(engines) + "\tauto")
+    for instance_type, capacity in product(["part1", "correlated"], capacities):
+        skipped = set()
+        for n_items in item_counts:
+            sizes = rng.integers(1, max(2, (4 * capacity) // n_items), size=n_items)
+            if instance_type == "part1":
+                values = (51 - (np.arange(n_items) % 50)) * sizes
+            else:
+                values = sizes + (capacity // 10)
+            items = [(int(v), int(s), j) for j, (v, s) in enumerate(zip(values, sizes))]
+            timings = []
+            results = set()
+            for engine in engines:
+                if engine in skipped or (engine == "meet_in_the_middle" and n_items > 44):
+                    timings.append("-")
+                    continue
+                if engine == "branch_and_bound":
+                    values, weights = [x[0] for x in items], [x[1] for x in items]
+                    try:
+                        elapsed, (_, value) = time_call(knapsack_engines.knapsack_branch_and_bound, values, weights,
+                                                        capacity, max_nodes)
+                    except knapsack_engines.NodeLimitExceeded:
+                        timings.append(">nodes")
+                        skipped.add(engine)
+                        continue
+                else:
+                    elapsed, (_, value) = time_call(knapsack_engines.solve_knapsack, items, capacity, engine)
+                results.add(value)
+                timings.append("{:.4f}".format(elapsed))
+                if elapsed > time_limit:
+                    skipped.add(engine)
+            assert (len(results) == 1)
+            print("{}\t{}\t{}\t\t".format(instance_type, n_items, capacity) + "\t\t".join(timings) + "\t\t" +
+                  knapsack_engines.select_knapsack_engine(n_items, capacity))
+
+
+def benchmark_model_builders(item_counts=(6, 8, 10, 12), capacity=440, penalty=2, risks=(0, 0.95), beta=0.5, seed=0):
+    """
+    Times the construction (without optimization) of the part5 models with build_expression_model and
+    build_matrix_model and prints one line per (n, risk) with the number of scenarios 2^n
+    :param item_counts: the numbers of items of the problem instances
+    :param capacity: the capacity of the knapsack
+    :param penalty: the penalty per size unit
+    :param risks: the model risks, 0 for the EV model
+    :param beta: the beta param of the CVaR models
+    :param seed: the seed of the random problem instances
+    """
+    gb.setParam("OutputFlag", 0)
+    rng = np.random.default_rng(seed)
+    print("n\tscenarios\trisk\texpression\tmatrix")
+    for n_items, risk in product(item_counts, risks):
+        arrays = part1.generate_problem_instance_arrays(1, n_items, 10, rng)
+        items = ItemTable(*(arrays[field][0] for field in ("dl", "dh", "pi", "r", "size")))
+        scenarios, revenues, probabilities = part5.get_model_data(items)
+        expression_time, model = time_call(part5.build_expression_model, scenarios, revenues, probabilities,
+                                           list(range(n_items)), capacity, penalty, risk, beta)
+        model.dispose()
+        matrix_time, model = time_call(part5.build_matrix_model, scenarios, revenues, probabilities, capacity,
+                                       penalty, risk, beta)
+        model.dispose()
+        print("{}\t{}\t\t{}\t{:.4f}\t\t{:.4f}".format(n_items, len(scenarios), risk, expression_time, matrix_time))
+
+
+def benchmark_solver_backends(item_counts=(4, 6, 8, 10), formulations=("scenario", "first_stage"), capacity=440,
+                              penalty=2, risks=(0, 0.95), beta=0.5, seed=0, time_limit=60):
+    """
+    Times the build and solve of the part5 models with the Gurobi and the HiGHS backend of solver_backends, both
+    from the same formulation data, and prints one line per (formulation, n, risk) with the number of scenarios
+    2^n and the two objective values (a dash if no solution was found). The build time of HiGHS is the assembly
+    of the milp arrays. Models that the Gurobi license does not allow are shown with a dash. Part1 instances
+    have item probabilities above 1 from the 12th item on, so n is at most 11.
+    :param item_counts: the numbers of items of the problem instances
+    :param formulations: the model formulations
+    :param capacity: the capacity of the knapsack
+    :param penalty: the penalty per size unit
+    :param risks: the model risks, 0 for the EV model
+    :param beta: the beta param of the CVaR models
+    :param seed: the seed of the random problem instances
+    :param time_limit: the time limit in seconds per solve
+    """
+    gb.setParam("OutputFlag", 0)
+    gb.setParam("TimeLimit", time_limit)
+    rng = np.random.default_rng(seed)
+    instances = {}
+    print("formulation\tn\tscenarios\trisk\tgurobi_build\tgurobi_solve\thighs_build\thighs_solve\t"
+          "gurobi_objective\thighs_objective")
+    for formulation, n_items, risk in product(formulations, item_counts, risks):
+        if n_items not in instances:
+            arrays = part1.generate_problem_instance_arrays(1, n_items, 10, rng)
+            instances[n_items] = ItemTable(*(arrays[field][0] for field in ("dl", "dh", "pi", "r", "size")))
+        scenarios, revenues, probabilities = part5.get_model_data(instances[n_items])
+        data = solver_backends.get_formulation(scenarios, revenues, probabilities, capacity, penalty, risk, beta,
+                                               formulation)
+        gurobi_build, (model, _) = time_call(solver_backends.build_gurobi_model, data)
+        try:
+            gurobi_solve, _ = time_call(model.optimize)
+            gurobi_times = "{:.4f}\t\t{:.4f}".format(gurobi_build, gurobi_solve)
+            gurobi_objective = "{:.2f}".format(model.ObjVal)
+        except gb.GurobiError:
+            gurobi_times, gurobi_objective = "{:.4f}\t\t-".format(gurobi_build), "-"
+        model.dispose()
+        highs_build, problem = time_call(solver_backends.get_highs_problem, data)
+        highs_solve, solution = time_call(solver_backends.solve_with_highs, data, time_limit, problem)
+        highs_objective = "-" if solution["objective"] is None else "{:.2f}".format(solution["objective"])
+        print("{}\t{}\t{}\t\t{}\t{}\t\t{:.4f}\t\t{:.4f}\t\t{}\t{}".format(
+            formulation, n_items, len(scenarios), risk, gurobi_times, highs_build, highs_solve, gurobi_objective,
+            highs_objective))
+
+
+def benchmark_risk_sweep(n_items=8, risks=tuple(np.linspace(0.5, 0.95, 10)), formulation="first_stage", capacity=440,
+                         penalty=2, beta=0.5, seed=0):
+    """
+    Times a sweep of the EV model and a CVaR model for every risk, once with a new model per risk
+    (solver_backends.build_gurobi_model) and once with a single warm-started model
+    (solver_backends.build_gurobi_risk_model), and prints the build and the total solve times and whether the
+    objective values of the two sweeps are the same
+    :param n_items: the number of items of the problem instance
+    :param risks: the CVaR risks
+    :param formulation: scenario or first_stage
+    :param capacity: the capacity of the knapsack
+    :param penalty: the penalty per size unit
+    :param beta: the beta param of the CVaR models
+    :param seed: the seed of the random problem instance
+    """
+    gb.setParam("OutputFlag", 0)
+    arrays = part1.generate_problem_instance_arrays(1, n_items, 10, np.random.default_rng(seed))
+    items = ItemTable(*(arrays[field][0] for field in ("dl", "dh", "pi", "r", "size")))
+    scenarios, revenues, probabilities = part5.get_model_data(items)
+    risks = [0] + list(risks)
+    build_time, solve_time, objectives = 0, 0, []
+    for risk in risks:
+        data = solver_backends.get_formulation(scenarios, revenues, probabilities, capacity, penalty, risk, beta,
+                                               formulation)
+        elapsed, (model, _) = time_call(solver_backends.build_gurobi_model, data)
+        build_time += elapsed
+        elapsed, _ = time_call(model.optimize)
+        solve_time += elapsed
+        objectives.append(model.ObjVal)
+        model.dispose()
+    print("new model per risk: build {:.4f}s, solve {:.4f}s".format(build_time, solve_time))
+    build_time, risk_model = time_call(solver_backends.build_gurobi_risk_model, scenarios, revenues, probabilities,
+                                       capacity, penalty, formulation)
+    solve_time, reused_objectives = 0, []
+    for risk in risks:
+        elapsed, model = time_call(solver_backends.solve_gurobi_risk_model, risk_model, risk, beta)
+        solve_time += elapsed
+        reused_objectives.append(model.ObjVal)
+    print("reused model: build {:.4f}s, solve {:.4f}s, same objectives: {}".format(
+        build_time, solve_time, np.allclose(objectives, reused_objectives)))
+    risk_model["model"].dispose()
+
+
+def benchmark_decomposition(scenario_counts=(1000, 10000, 100000), n_items=10, capacity=440, penalty=2,
+                            risks=(0, 0.95), beta=0.5, seed=0, backend="gurobi"):
+    """
+    Times the first_stage model of sampled (SAA) scenarios solved whole with HiGHS and with the Benders
+    decomposition of benders.solve_benders with aggregated and multi_cut cuts, and prints one line per
+    (scenarios, risk) with the times, the iterations and cuts of the decompositions and their objective gap to the
+    whole model (a dash if the whole model was not solved).
+    Master problems that the Gurobi license does not allow are shown with dashes.
+    :param scenario_counts: the numbers of sampled scenarios
+    :param n_items: the number of items of the problem instance
+    :param capacity: the capacity of the knapsack
+    :param penalty: the penalty per size unit
+    :param risks: the model risks, 0 for the EV model
+    :param beta: the beta param of the CVaR models
+    :param seed: the seed of the random problem instance and scenarios
+    :param backend: the solver of the master problems
+    """
+    rng = np.random.default_rng(seed)
+    arrays = part1.generate_problem_instance_arrays(1, n_items, 10, rng)
+    table = ItemTable(*(arrays[field][0] for field in ("dl", "dh", "pi", "r", "size")))
+    print("scenarios\trisk\twhole\t\taggregated\titerations\tcuts\tgap\t\tmulti_cut\titerations\tcuts\tgap")
+    for num_scenarios, risk in product(scenario_counts, risks):
+        scenarios = np.where(rng.random((num_scenarios, n_items)) < table.pi, table.dh, table.dl)
+        probabilities = np.full(num_scenarios, 1 / num_scenarios)
+        data = solver_backends.get_formulation(scenarios, table.r, probabilities, capacity, penalty, risk, beta,
+                                               "first_stage")
+        whole_time, whole = time_call(solver_backends.solve_with_highs, data)
+        line = "{}\t\t{}\t{:.4f}".format(num_scenarios, risk, whole_time)
+        for cuts in ("aggregated", "multi_cut"):
+            try:
+                solve_time, solution = time_call(benders.solve_benders, scenarios, table.r, probabilities, capacity,
+                                                 penalty, risk, beta, cuts, backend)
+            except gb.GurobiError:
+                line += "\t\t-\t\t-\t\t-\t-"
+                continue
+            gap = "-" if whole["objective"] is None else "{:.2e}".format(whole["objective"] - solution["objective"])
+            line += "\t\t{:.4f}\t\t{}\t\t{}\t{}".format(solve_time, solution["iterations"], solution["cuts"], gap)
+        print(line)
+
+
+if __name__ == '__main__':
+    benchmark_knapsack_engines()
+    benchmark_model_builders()
+    benchmark_solver_backends()
+    benchmark_risk_sweep()
+    benchmark_decomposition()
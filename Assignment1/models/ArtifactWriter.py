@@ -0,0 +1,171 @@
+import gzip
+from os.path import join
+from queue import Queue
+from threading import Lock, Thread
+
+import gurobipy as gb
+
+
+class ArtifactWriter:
+    """
+    Writes the model files of the part5 and part7 models. The mode selects the files: full for the model (.mps)
+    and its solution (.sol), solution for the .sol only and off for none. With gzip compression the files get a
+    .gz suffix. With background writing the files are written by a background thread, so the next model is
+    built and solved while they are written; close waits for the pending files. The solution text is formatted
+    by the caller on the solving thread. For the .mps file the model is copied on the solving thread into a
+    gurobi environment of the writer, since a gurobi environment must not be used by two threads and the reused
+    models change after their solve, and the copy is written (and compressed by gurobi) by the background thread.
+    Gurobi holds the GIL while it writes, so the write overlaps with the solve of the next model, which releases
+    it, rather than with its build.
+    """
+    modes = ("full", "solution", "off")
+    compressions = ("none", "gzip")
+
+    def __init__(self, mode="full", compression="none", background=True, max_pending=4):
+        """
+        :param mode: full, solution or off
+        :param compression: none or gzip
+        :param background: whether the files are written by a background thread
+        :param max_pending: the maximum number of files waiting to be written, the callers wait above it
+        """
+        if mode not in self.modes:
+            raise Exception("Unknown model artifacts mode {}".format(mode))
+        if compression not in self.compressions:
+            raise Exception("Unknown model artifacts compression {}".format(compression))
+        self.mode = mode
+        self.compression = compression
+        self.error = None
+        self.queue = None
+        self.thread = None
+        # the gurobi environment of the model copies, used under the lock, created at the first copy
+        self.env = None
+        self.env_lock = Lock()
+        if background and mode != "off":
+            self.queue = Queue(max_pending)
+            self.thread = Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    @classmethod
+    def from_properties(cls, properties):
+        """
+        :param properties: dictionary with the properties from yaml file
+        :return: the writer of the model_artifacts, model_artifacts_compression and model_artifacts_background
+        properties
+        """
+        mode = properties.get("model_artifacts", "full")
+        # yaml reads an unquoted off as False
+        return cls("off" if mode is False else mode, properties.get("model_artifacts_compression", "none"),
+                   properties.get("model_artifacts_background", True))
+
+    def path(self, folder, name, extension):
+        """
+        :return: the path of the file name.extension in the folder, with the compression suffix
+        """
+        return join(folder, "{}.{}{}".format(name, extension, ".gz" if self.compression == "gzip" else ""))
+
+    def write_model(self, model, folder, name, removed=None):
+        """
+        Writes the .mps file of a gurobi model, in the full mode only
+        :param model: the gurobi model
+        :param folder: the output folder
+        :param name: the file name without extension
+        :param removed: the (variable indices, constraint indices) left out of the file, if None the whole model
+        """
+        if self.mode != "full":
+            return
+        self.check_error()
+        path = self.path(folder, name, "mps")
+        if self.queue is None:
+            if removed is None:
+                model.write(path)
+            else:
+                self.write(path, self.copy_model(model, removed))
+            return
+        with self.env_lock:
+            if self.env is None:
+                self.env = gb.Env(empty=True)
+                self.env.setParam("OutputFlag", 0)
+                self.env.start()
+            copy = self.copy_model(model, removed, self.env)
+        self.queue.put((path, copy))
+
+    @staticmethod
+    def copy_model(model, removed=None, env=None):
+        """
+        :param model: the gurobi model
+        :param removed: the (variable indices, constraint indices) removed from the copy, if None none
+        :param env: the gurobi environment of the copy, if None the one of the model
+        :return: a copy of the model with its name
+        """
+        copy = model.copy() if env is None else model.copy(env=env)
+        copy.ModelName = model.ModelName
+        if removed is not None:
+            variables, constraints = copy.getVars(), copy.getConstrs()
+            copy.remove([constraints[i] for i in removed[1]])
+            copy.remove([variables[i] for i in removed[0]])
+            copy.update()
+        return copy
+
+    def write_solution(self, folder, name, text):
+        """
+        Writes the .sol file, in the full and solution modes
+        :param folder: the output folder
+        :param name: the file name without extension
+        :param text: the content of the file
+        """
+        if self.mode == "off":
+            return
+        self.check_error()
+        if self.queue is None:
+            self.write(self.path(folder, name, "sol"), text)
+        else:
+            self.queue.put((self.path(folder, name, "sol"), text))
+
+    def write(self, path, content):
+        """
+        :param path: the file path
+        :param content: the text of a .sol file or the model copy of a .mps file
+        """
+        if isinstance(content, gb.Model):
+            with self.env_lock:
+                try:
+                    content.write(path)
+                finally:
+                    content.dispose()
+            return
+        opener = gzip.open if self.compression == "gzip" else open
+        with opener(path, "wt") as f:
+            f.write(content)
+
+    def run(self):
+        """
+        The loop of the background thread, until close puts None in the queue. A failed write is raised by the next
+        write_model or write_solution or by close.
+        """
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            try:
+                self.write(*item)
+            except Exception as e:
+                self.error = e
+
+    def check_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def close(self):
+        """
+        Waits for the pending files and stops the background thread
+        """
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+            self.queue = None
+        if self.env is not None:
+            self.env.dispose()
+            self.env = None
+        self.check_error()
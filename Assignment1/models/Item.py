@@ -11,6 +11,8 @@ class Item:
     pi = 0
     r = 0
     decision_variable = 0
+    # set by freeze, a frozen item raises an exception when a field is changed
+    frozen = False
 
     def __init__(self, position=-1):
         """
@@ -23,6 +25,19 @@ class Item:
         else:
             self.position = position
 
+    def __setattr__(self, name, value):
+        if self.frozen:
+            raise Exception("Item {} is read-only, its fields cannot be changed".format(self.position))
+        super().__setattr__(name, value)
+
+    def freeze(self):
+        """
+        Makes the item read-only
+        :return: the item
+        """
+        super().__setattr__("frozen", True)
+        return self
+
     def __str__(self):
         representation = ""
         representation += "Item{\n"
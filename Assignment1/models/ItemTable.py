@@ -0,0 +1,83 @@
+import numpy as np
+
+from models.Item import Item
+
+
+class ItemTable:
+    """
+    Struct-of-arrays representation of the items of a problem instance. Instead of one Item object per item,
+    each field (position, dl, dh, pi, r and size) is stored in a numpy array with one element per item.
+    Conversion from and to Item objects is available with the from_items and to_items methods.
+    """
+    __slots__ = ("position", "dl", "dh", "pi", "r", "size")
+
+    def __init__(self, dl, dh, pi, r, size, position=None):
+        """
+        ItemTable constructor. All the arrays should have the same length, i.e. the number of items.
+        :param dl: the low sizes of the items
+        :param dh: the high sizes of the items
+        :param pi: the probabilities of the high sizes
+        :param r: the revenues of the items
+        :param size: the sizes calculated from dl, dh and pi
+        :param position: the positions of the items in the problem instance, if None 0..n-1 is used
+        """
+        self.dl = np.asarray(dl, dtype=np.int32)
+        self.dh = np.asarray(dh, dtype=np.int32)
+        self.pi = np.asarray(pi, dtype=np.float64)
+        self.r = np.asarray(r, dtype=np.int32)
+        self.size = np.asarray(size, dtype=np.int32)
+        self.position = np.arange(len(self.dl), dtype=np.int32) if position is None \
+            else np.asarray(position, dtype=np.int32)
+
+    @classmethod
+    def from_items(cls, items):
+        """
+        Creates an ItemTable from a list of Item objects. If an ItemTable is given, it is returned as is,
+        so the method can be used by functions that accept both representations.
+        :param items: list of Item objects or an ItemTable
+        :return: the ItemTable
+        """
+        if isinstance(items, cls):
+            return items
+        return cls(dl=[item.dl for item in items], dh=[item.dh for item in items], pi=[item.pi for item in items],
+                   r=[item.r for item in items], size=[item.size for item in items],
+                   position=[item.position for item in items])
+
+    def to_items(self):
+        """
+        Creates the equivalent list of Item objects
+        :return: list of Item objects
+        """
+        items = []
+        for position, dl, dh, pi, r, size in zip(self.position.tolist(), self.dl.tolist(), self.dh.tolist(),
+                                                 self.pi.tolist(), self.r.tolist(), self.size.tolist()):
+            item = Item(position)
+            item.dl = dl
+            item.dh = dh
+            item.pi = pi
+            item.r = r
+            item.size = size
+            items.append(item)
+        return items
+
+    def select(self, indices):
+        """
+        Creates a new ItemTable with the items in the given indices (e.g. the items selected by the knapsack)
+        :param indices: list of indices or boolean mask
+        :return: the new ItemTable
+        """
+        return ItemTable(dl=self.dl[indices], dh=self.dh[indices], pi=self.pi[indices], r=self.r[indices],
+                         size=self.size[indices], position=self.position[indices])
+
+    def __len__(self):
+        return len(self.dl)
+
+    def __str__(self):
+        representation = "ItemTable{\n"
+        for field in self.__slots__:
+            representation += field + "=" + str(getattr(self, field).tolist()) + ",\n"
+        representation += "}\n"
+        return representation
+
+    def __repr__(self):
+        return self.__str__()
@@ -1,7 +1,11 @@
 class MonteCarloSim:
-    run = -1
-    items = []
-    profit = -1
+    """
+    Result of one Monte Carlo run: the positions of the simulated items, their sizes in this run and the profit
+    """
+    __slots__ = ("run", "positions", "sizes", "profit")
 
     def __init__(self, run):
         self.run = run
+        self.positions = []
+        self.sizes = []
+        self.profit = -1
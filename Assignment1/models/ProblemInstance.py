@@ -1,20 +1,54 @@
+from models.ItemTable import ItemTable
+
+
 class ProblemInstance:
     """
-    ProblemInstance class represents a generated instance. It has only one field, i.e. items,
-    where the 10 generated items are stored
+    ProblemInstance class represents a generated instance. The items of the instance are stored in a single
+    ItemTable (item_table), the only source of truth: an instance created with a list of Item objects converts
+    it to the table once. The items field gives the items as a new tuple of read-only Item objects at every
+    access, so appending to it or changing its items raises an exception instead of being lost; add_item adds an
+    item and assigning a list to items replaces the table.
     """
-    items = []
 
-    def __init__(self, item_list=None):
-        if item_list is None:
-            item_list = []
-        self.items = item_list
+    def __init__(self, item_list=None, item_table=None):
+        if item_table is None:
+            item_table = ItemTable.from_items([] if item_list is None else item_list)
+        self._item_table = item_table
+
+    @property
+    def items(self):
+        return tuple(item.freeze() for item in self._item_table.to_items())
+
+    @items.setter
+    def items(self, item_list):
+        self._item_table = ItemTable.from_items(item_list)
+
+    def add_item(self, item):
+        """
+        Adds an item at the end of the instance, replacing the table (linear in the number of items)
+        :param item: the Item object
+        """
+        self._item_table = ItemTable.from_items(self._item_table.to_items() + [item])
+
+    @property
+    def item_table(self):
+        """
+        The items as an ItemTable
+        """
+        return self._item_table
+
+    def __setstate__(self, state):
+        # problem instances pickled with older versions store the list of Item objects in the items or _items field
+        item_list = state.get("items", state.get("_items"))
+        item_table = state.get("_item_table")
+        self._item_table = ItemTable.from_items(item_list) if item_table is None else item_table
 
     def __str__(self):
         representation = ''
-        if self.items:
+        items = self.items
+        if items:
             representation = "ProblemInstance{"
-            for item in self.items:
+            for item in items:
                 representation += item.__str__()
             representation += "},\n"
         return representation
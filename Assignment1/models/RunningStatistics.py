@@ -0,0 +1,60 @@
+import numpy as np
+
+
+class RunningStatistics:
+    """
+    Online mean and variance of a stream of values (Welford / Chan et al.). Only the count, the mean
+    and the sum of squared deviations (m2) are kept, so the memory does not depend on the number of values.
+    Statistics of different streams can be merged, e.g. the partial results of parallel workers.
+    """
+    __slots__ = ("count", "mean", "m2")
+
+    def __init__(self, count=0, mean=0.0, m2=0.0):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+
+    def update(self, values):
+        """
+        Adds a chunk of values to the statistics
+        :param values: array with the new values
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if values.size == 0:
+            return
+        chunk_mean = values.mean()
+        self.merge(RunningStatistics(values.size, chunk_mean, float(((values - chunk_mean) ** 2).sum())))
+
+    def merge(self, other):
+        """
+        Merges the statistics of another stream into this one
+        :param other: the RunningStatistics of the other stream
+        """
+        count = self.count + other.count
+        if count == 0:
+            return
+        delta = other.mean - self.mean
+        self.mean = float(self.mean + (delta * other.count / count))
+        self.m2 = float(self.m2 + other.m2 + (delta ** 2 * self.count * other.count / count))
+        self.count = count
+
+    def variance(self, ddof=0):
+        return self.m2 / (self.count - ddof) if self.count > ddof else 0.0
+
+    def std(self, ddof=0):
+        return np.sqrt(self.variance(ddof))
+
+    def half_width(self, z):
+        """
+        The half width of the confidence interval of the mean
+        :param z: the quantile of the standard normal distribution for the requested confidence
+        :return: the half width
+        """
+        return z * self.std() / np.sqrt(self.count) if self.count > 0 else np.inf
+
+    def __str__(self):
+        return "RunningStatistics{count=" + str(self.count) + ", mean=" + str(self.mean) + ", m2=" + \
+               str(self.m2) + "}"
+
+    def __repr__(self):
+        return self.__str__()
@@ -0,0 +1,253 @@
+import gurobipy as gb
+import numpy as np
+from scipy import optimize, sparse
+
+from questions import exact_evaluation
+
+
+def solve_benders(scenarios, revenues, probabilities, capacity, penalty, risk, beta=None, cuts="aggregated",
+                  backend="gurobi", tolerance=1e-6, max_iterations=1000):
+    """
+    Benders (L-shaped) decomposition of the first-stage EV (risk 0) or CVaR model (see
+    solver_backends.get_formulation). The master problem has the selection x, eta for CVaR, and variables that
+    over-estimate the expected profit (theta) and under-estimate the expected CVaR shortfall (phi). The subproblem
+    of a scenario has a closed form: the profit is revenues_j * x - penalty * max(0, sizes_j * x - capacity) and
+    the shortfall is max(0, eta - profit). Both are the minimum, resp. maximum, of a few linear pieces, so the
+    piece that is active at the master solution is a valid optimality cut. With aggregated cuts theta and phi are
+    single variables and every iteration adds one cut for each, so the master grows with the iterations and not
+    with the scenarios. With multi_cut, theta and phi have a variable per scenario and every iteration adds the
+    cuts of the violated scenarios only. The lower bound is the true objective of the best selection found (with
+    its best eta), the upper bound the master objective, and the loop stops at a relative gap of tolerance.
+    :param scenarios: the (scenarios x items) size matrix
+    :param revenues: the revenue of each item
+    :param probabilities: the probability vector of the scenarios
+    :param capacity: the capacity of the knapsack
+    :param penalty: the penalty per size unit
+    :param risk: model risk, 0 for the EV model
+    :param beta: beta param of the CVaR model
+    :param cuts: aggregated or multi_cut
+    :param backend: the solver of the master problem, gurobi or highs
+    :param tolerance: the relative gap between the bounds at which the loop stops
+    :param max_iterations: the maximum number of master solves
+    :return: dictionary as the one of solver_backends.solve_with_highs, with the status (optimal or limit), the
+    objective, the values of the variables of the first-stage formulation, their variable blocks, the upper bound
+    and the number of iterations and cuts
+    """
+    if cuts not in ("aggregated", "multi_cut"):
+        raise Exception("Unknown Benders cuts {}".format(cuts))
+    scenarios = np.asarray(scenarios, dtype=np.float64)
+    probabilities = np.asarray(probabilities, dtype=np.float64)
+    total_revenues = scenarios * np.asarray(revenues, dtype=np.float64)
+    master = get_master_problem(total_revenues, probabilities, risk, beta, cuts)
+    solve_master = solve_gurobi_master if backend == "gurobi" else solve_highs_master
+    if backend not in ("gurobi", "highs"):
+        raise Exception("Unknown solver backend {}".format(backend))
+    state = {}
+    best, lower_bound, upper_bound = None, -np.inf, np.inf
+    iteration, num_cuts = 0, 0
+    while iteration < max_iterations:
+        iteration += 1
+        values, upper_bound = solve_master(master, state)
+        decision = np.round(values[master["x"]])
+        eta = values[master["eta"]][0] if risk != 0 else 0.0
+        profits = (total_revenues @ decision) - (penalty * np.maximum((scenarios @ decision) - capacity, 0))
+        objective, best_eta = evaluate_selection(profits, probabilities, risk, beta, master["eta_upper"])
+        if objective > lower_bound:
+            best, lower_bound = (decision, best_eta, profits), objective
+        if upper_bound - lower_bound <= tolerance * max(1.0, abs(upper_bound)):
+            break
+        rows, rhs = get_cuts(master, values, decision, eta, profits, scenarios, total_revenues, probabilities,
+                             capacity, penalty, risk, tolerance)
+        if len(rhs) == 0:
+            break
+        master["rows"].append(rows)
+        master["rhs"].append(rhs)
+        num_cuts += len(rhs)
+    decision, eta, profits = best
+    tu = np.maximum((scenarios @ decision) - capacity, 0)
+    solution_values = {"decision_var": decision, "penalty_decision": tu}
+    variables = [{"name": "decision_var", "shape": decision.shape, "binary": True},
+                 {"name": "penalty_decision", "shape": tu.shape, "binary": False}]
+    if risk != 0:
+        solution_values["eta"] = np.array([eta])
+        solution_values["sw"] = np.maximum(eta - profits, 0)
+        variables = ([{"name": "eta", "shape": (1,), "binary": False}] + variables +
+                     [{"name": "sw", "shape": tu.shape, "binary": False}])
+    converged = upper_bound - lower_bound <= tolerance * max(1.0, abs(upper_bound))
+    return {"status": "optimal" if converged else "limit",
+            "message": "{} iterations, {} cuts, bounds {} {}".format(iteration, num_cuts, lower_bound, upper_bound),
+            "objective": lower_bound, "values": solution_values, "variables": variables, "bound": upper_bound,
+            "iterations": iteration, "cuts": num_cuts}
+
+
+def get_master_problem(total_revenues, probabilities, risk, beta, cuts):
+    """
+    The master problem as a maximization over a single variable vector [x, eta, theta, phi] (eta and phi only for
+    CVaR) with objective c, bounds, integrality and the cut rows (rows @ vector <= rhs) added so far. Theta is
+    bounded by the revenue of all the items and eta by the largest scenario revenue, so the master is bounded
+    before the first cut.
+    :return: dictionary with the master problem and the slices of its variables
+    """
+    num_scenarios, num_items = total_revenues.shape
+    num_copies = 1 if cuts == "aggregated" else num_scenarios
+    weights = np.ones(1) if cuts == "aggregated" else probabilities
+    scenario_revenues = total_revenues.sum(axis=1)
+    weight = 0 if risk == 0 else beta
+    x = slice(0, num_items)
+    eta = slice(num_items, num_items + (1 if risk != 0 else 0))
+    theta = slice(eta.stop, eta.stop + num_copies)
+    phi = slice(theta.stop, theta.stop + (num_copies if risk != 0 else 0))
+    num_variables = phi.stop
+    c = np.zeros(num_variables)
+    c[theta] = (1 - weight) * weights
+    lower = np.zeros(num_variables)
+    upper = np.full(num_variables, np.inf)
+    upper[x] = 1
+    lower[theta] = -np.inf
+    upper[theta] = probabilities @ scenario_revenues if cuts == "aggregated" else scenario_revenues
+    eta_upper = float(scenario_revenues.max())
+    if risk != 0:
+        c[eta] = weight
+        c[phi] = -(weight / (1 - risk)) * weights
+        upper[eta] = eta_upper
+    integrality = np.zeros(num_variables)
+    integrality[x] = 1
+    return {"c": c, "lower": lower, "upper": upper, "integrality": integrality, "rows": [], "rhs": [],
+            "x": x, "eta": eta, "theta": theta, "phi": phi, "cuts": cuts, "eta_upper": eta_upper}
+
+
+def get_cuts(master, values, decision, eta, profits, scenarios, total_revenues, probabilities, capacity, penalty,
+             risk, tolerance):
+    """
+    The optimality cuts at the master solution that it violates. The profit cut of scenario j is
+    theta_j <= revenues_j * x - penalty * a_j * (sizes_j * x - capacity), with a_j = 1 if the selection overflows
+    in scenario j, and the shortfall cut is phi_j >= b_j * (eta - revenues_j * x) + c_j * penalty * (sizes_j * x -
+    capacity), with the pieces b_j, c_j of the shortfall that are active at the master solution. Aggregated cuts are
+    the probability-weighted sums of the scenario cuts.
+    :return: the sparse cut rows and their right-hand sides, in the form rows @ vector <= rhs
+    """
+    num_variables = len(master["c"])
+    overflow = (scenarios @ decision) > capacity
+    # theta_j - (revenues_j - penalty * a_j * sizes_j) * x <= penalty * a_j * capacity
+    profit_coefficients = -(total_revenues - (penalty * overflow[:, None] * scenarios))
+    profit_rhs = penalty * overflow * capacity
+    rows, rhs = [], []
+    if master["cuts"] == "aggregated":
+        if values[master["theta"]][0] > (probabilities @ profits) + tolerance * max(1.0, abs(probabilities @ profits)):
+            row = np.zeros(num_variables)
+            row[master["x"]] = probabilities @ profit_coefficients
+            row[master["theta"]] = 1
+            rows.append(row[None, :])
+            rhs.append([probabilities @ profit_rhs])
+    else:
+        violated = np.flatnonzero(values[master["theta"]] > profits + tolerance * np.maximum(1.0, np.abs(profits)))
+        if len(violated) > 0:
+            rows.append(cut_rows(num_variables, master["x"], master["theta"], violated, profit_coefficients[violated]))
+            rhs.append(profit_rhs[violated])
+    if risk != 0:
+        # the shortfall max(0, eta - revenues_j * x, eta - revenues_j * x + penalty * (sizes_j * x - capacity))
+        pieces = np.stack((np.zeros(len(profits)), eta - (total_revenues @ decision),
+                           eta - (total_revenues @ decision) + penalty * ((scenarios @ decision) - capacity)))
+        active = np.argmax(pieces, axis=0)
+        shortfalls = pieces.max(axis=0)
+        with_eta = (active > 0).astype(np.float64)
+        with_overflow = (active == 2).astype(np.float64)
+        # -phi_j + b_j * eta - (b_j * revenues_j - c_j * penalty * sizes_j) * x <= c_j * penalty * capacity
+        shortfall_coefficients = -((with_eta[:, None] * total_revenues) -
+                                   (penalty * with_overflow[:, None] * scenarios))
+        shortfall_rhs = penalty * with_overflow * capacity
+        if master["cuts"] == "aggregated":
+            expected = probabilities @ shortfalls
+            if values[master["phi"]][0] < expected - tolerance * max(1.0, expected):
+                row = np.zeros(num_variables)
+                row[master["x"]] = probabilities @ shortfall_coefficients
+                row[master["eta"]] = probabilities @ with_eta
+                row[master["phi"]] = -1
+                rows.append(row[None, :])
+                rhs.append([probabilities @ shortfall_rhs])
+        else:
+            violated = np.flatnonzero(values[master["phi"]] < shortfalls - tolerance * np.maximum(1.0, shortfalls))
+            if len(violated) > 0:
+                scenario_rows = cut_rows(num_variables, master["x"], master["phi"], violated,
+                                         shortfall_coefficients[violated], -1.0).tolil()
+                scenario_rows[:, master["eta"].start] = with_eta[violated][:, None]
+                rows.append(scenario_rows.tocsr())
+                rhs.append(shortfall_rhs[violated])
+    if len(rows) == 0:
+        return None, np.zeros(0)
+    return sparse.vstack([sparse.csr_matrix(row) for row in rows], format="csr"), np.concatenate(rhs)
+
+
+def cut_rows(num_variables, x, copies, scenarios, x_coefficients, copy_coefficient=1.0):
+    """
+    :return: sparse rows with the given coefficients of x and copy_coefficient for the copy (theta_j or phi_j) of
+    each of the given scenarios
+    """
+    num_rows, num_items = x_coefficients.shape
+    row_indices = np.repeat(np.arange(num_rows), num_items + 1)
+    column_indices = np.column_stack((np.tile(np.arange(x.start, x.stop), (num_rows, 1)), copies.start + scenarios))
+    data = np.column_stack((x_coefficients, np.full(num_rows, copy_coefficient)))
+    return sparse.csr_matrix((data.ravel(), (row_indices, column_indices.ravel())), shape=(num_rows, num_variables))
+
+
+def evaluate_selection(profits, probabilities, risk, beta, eta_upper):
+    """
+    The true objective of a selection, with the best eta for CVaR: the (1 - risk) quantile of the profit
+    (exact_evaluation.value_at_risk), within the bounds of eta
+    :param profits: the profit of the selection in each scenario
+    :param probabilities: the probability vector of the scenarios
+    :param risk: model risk, 0 for the EV model
+    :param beta: beta param of the CVaR model
+    :param eta_upper: the upper bound of eta
+    :return: the objective and the best eta
+    """
+    expected_profit = float(probabilities @ profits)
+    if risk == 0:
+        return expected_profit, 0.0
+    values, value_probabilities = exact_evaluation.merge_outcomes(profits, probabilities)
+    eta = min(max(exact_evaluation.value_at_risk(values, value_probabilities, risk)[0], 0.0), eta_upper)
+    cvar = eta - (probabilities @ np.maximum(eta - profits, 0)) / (1 - risk)
+    return float((1 - beta) * expected_profit + beta * cvar), float(eta)
+
+
+def solve_gurobi_master(master, state):
+    """
+    Solves the master problem with gurobi. The model is built at the first call and only the new cuts are added
+    to it at the next calls, so gurobi can start from the previous solution.
+    :param master: the master problem of get_master_problem
+    :param state: dictionary kept between the calls
+    :return: the values of the master variables and the master objective
+    """
+    if "model" not in state:
+        model = gb.Model('Benders master')
+        model.Params.OutputFlag = 0
+        vector = model.addMVar(len(master["c"]), lb=master["lower"], ub=master["upper"],
+                               vtype=np.where(master["integrality"] > 0, gb.GRB.BINARY, gb.GRB.CONTINUOUS))
+        model.setObjective(master["c"] @ vector, gb.GRB.MAXIMIZE)
+        state.update(model=model, vector=vector, num_cuts=0)
+    model, vector = state["model"], state["vector"]
+    for rows, rhs in zip(master["rows"][state["num_cuts"]:], master["rhs"][state["num_cuts"]:]):
+        model.addMConstr(rows, vector, gb.GRB.LESS_EQUAL, rhs)
+    state["num_cuts"] = len(master["rows"])
+    model.optimize()
+    if model.status != gb.GRB.Status.OPTIMAL:
+        raise Exception("Benders master problem stopped with status {}".format(model.status))
+    return vector.X, model.ObjVal
+
+
+def solve_highs_master(master, state):
+    """
+    Solves the master problem with HiGHS (scipy.optimize.milp), from scratch at every call
+    :param master: the master problem of get_master_problem
+    :param state: not used, for the same signature as solve_gurobi_master
+    :return: the values of the master variables and the master objective
+    """
+    constraints = None
+    if len(master["rows"]) > 0:
+        constraints = optimize.LinearConstraint(sparse.vstack(master["rows"], format="csr"), -np.inf,
+                                                np.concatenate(master["rhs"]))
+    result = optimize.milp(-master["c"], integrality=master["integrality"],
+                           bounds=optimize.Bounds(master["lower"], master["upper"]), constraints=constraints)
+    if result.status != 0:
+        raise Exception("Benders master problem stopped: {}".format(result.message))
+    return result.x, -result.fun
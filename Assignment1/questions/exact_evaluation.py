@@ -0,0 +1,177 @@
+import numpy as np
+
+from models.ItemTable import ItemTable
+from questions.monte_carlo_engines import simulate_profits
+
+# up to this number of items the outcomes are enumerated, above it the state Dynamic Programming is used
+enumeration_max_items = 16
+# maximum number of (load, profit) states of the Dynamic Programming of the profit distribution
+default_max_states = 10 ** 6
+
+
+class StateLimitExceeded(Exception):
+    """
+    Raised by exact_profit_distribution when the profit distribution has more states than the limit
+    """
+
+
+def evaluate_selection(items, capacity, penalty, alpha=0.95, profit_model="sequential", max_states=None):
+    """
+    Exact evaluation of a fixed selection of items, whose sizes are dl or dh with probabilities 1 - pi and pi.
+    Two profit models are supported: sequential, where items are added in order and an item that does not fit
+    is excluded and penalized with its whole size (as in the Monte Carlo simulation of part2And3), and overflow,
+    where all items earn their revenue and only the size above the capacity is penalized (as in the part5 model).
+    The expected profit is computed with a Dynamic Programming over the load (sequential) or a convolution over
+    the total size (overflow), whose cost is polynomial. VaR and CVaR need the whole profit distribution,
+    see exact_profit_distribution.
+    CVaR is the expected profit of the worst (1 - alpha) tail, i.e. max over eta of eta - E[(eta - profit)+] /
+    (1 - alpha), the same definition as the CVaR model of part5, and VaR is the eta that reaches the maximum.
+    :param items: list of Item objects or ItemTable with the selected items
+    :param capacity: the capacity of the knapsack
+    :param penalty: the penalty per size unit
+    :param alpha: the CVaR risk level, if None only the expected profit is computed
+    :param profit_model: sequential or overflow
+    :param max_states: the state limit of exact_profit_distribution
+    :return: dictionary with the expected_profit and, if alpha is given, the var and cvar of the profit
+    """
+    table = ItemTable.from_items(items)
+    if profit_model == "sequential":
+        expected_profit = sequential_expected_profit(table, capacity, penalty)
+    elif profit_model == "overflow":
+        expected_profit = overflow_expected_profit(table, capacity, penalty)
+    else:
+        raise Exception("Unknown profit model {}".format(profit_model))
+    result = {"expected_profit": expected_profit}
+    if alpha is not None:
+        profits, probabilities = exact_profit_distribution(table, capacity, penalty, profit_model, max_states)
+        result["var"], result["cvar"] = value_at_risk(profits, probabilities, alpha)
+    return result
+
+
+def sequential_expected_profit(table, capacity, penalty):
+    """
+    Expected profit of the sequential model. The probability vector of the knapsack load (0..capacity) is
+    propagated item by item and the expected contribution of each item is added, O(n * capacity).
+    :param table: ItemTable with the selected items
+    :param capacity: the capacity of the knapsack
+    :param penalty: the penalty per size unit
+    :return: the expected profit
+    """
+    load = np.zeros(capacity + 1)
+    load[0] = 1.0
+    loads = np.arange(capacity + 1)
+    expected_profit = 0.0
+    for dl, dh, pi, r in zip(table.dl.tolist(), table.dh.tolist(), table.pi.tolist(), table.r.tolist()):
+        new_load = np.zeros(capacity + 1)
+        for size, probability in ((dl, 1 - pi), (dh, pi)):
+            if probability == 0:
+                continue
+            fits = loads + size <= capacity
+            fit_probability = load[fits].sum()
+            expected_profit += probability * size * ((fit_probability * r) - ((1 - fit_probability) * penalty))
+            # the load grows by size where the item fits and stays the same where it is excluded
+            if size <= capacity:
+                new_load[size:] += probability * load[:capacity + 1 - size]
+            new_load += probability * np.where(fits, 0, load)
+        load = new_load
+    return float(expected_profit)
+
+
+def overflow_expected_profit(table, capacity, penalty):
+    """
+    Expected profit of the overflow model: expected revenue minus penalty times the expected overflow. The
+    distribution of the total size is the convolution of the two-point size distributions of the items.
+    :param table: ItemTable with the selected items
+    :param capacity: the capacity of the knapsack
+    :param penalty: the penalty per size unit
+    :return: the expected profit
+    """
+    expected_revenue = float(np.sum(table.r * ((table.pi * table.dh) + ((1 - table.pi) * table.dl))))
+    total_size = np.ones(1)
+    for dl, dh, pi in zip(table.dl.tolist(), table.dh.tolist(), table.pi.tolist()):
+        item_size = np.zeros(max(dl, dh) + 1)
+        item_size[dl] += 1 - pi
+        item_size[dh] += pi
+        total_size = np.convolve(total_size, item_size)
+    overflow = np.maximum(np.arange(len(total_size)) - capacity, 0)
+    return expected_revenue - (penalty * float(total_size @ overflow))
+
+
+def exact_profit_distribution(items, capacity, penalty, profit_model="sequential", max_states=None):
+    """
+    The exact distribution of the profit of a selection. For up to enumeration_max_items items all the 2^n
+    dl/dh outcomes are enumerated with numpy from a bit-pattern matrix. For more items a Dynamic Programming
+    over the (load, profit) states merges the outcomes that reach the same state; its number of states
+    depends on the instance and it raises StateLimitExceeded above max_states states.
+    :param items: list of Item objects or ItemTable with the selected items
+    :param capacity: the capacity of the knapsack
+    :param penalty: the penalty per size unit
+    :param profit_model: sequential or overflow
+    :param max_states: the state limit, if None default_max_states is used
+    :return: the sorted distinct profit values and their probabilities
+    """
+    table = ItemTable.from_items(items)
+    if len(table) <= enumeration_max_items:
+        patterns = ((np.arange(2 ** len(table))[:, None] >> np.arange(len(table))) & 1).astype(bool)
+        sizes = np.where(patterns, table.dh, table.dl)
+        probabilities = np.prod(np.where(patterns, table.pi, 1 - table.pi), axis=1)
+        if profit_model == "sequential":
+            profits = simulate_profits(sizes, table, capacity, penalty)
+        else:
+            profits = (sizes @ table.r.astype(np.int64)) - (penalty * np.maximum(sizes.sum(axis=1) - capacity, 0))
+        return merge_outcomes(profits, probabilities)
+    return state_profit_distribution(table, capacity, penalty, profit_model,
+                                     default_max_states if max_states is None else max_states)
+
+
+def state_profit_distribution(table, capacity, penalty, profit_model, max_states):
+    """
+    Dynamic Programming over the (load, profit) states for exact_profit_distribution. For the overflow model
+    the load is the total size and the profit the revenue, the penalty is applied at the end.
+    :return: the sorted distinct profit values and their probabilities
+    """
+    loads = np.zeros(1, dtype=np.int64)
+    profits = np.zeros(1, dtype=np.int64)
+    probabilities = np.ones(1)
+    for dl, dh, pi, r in zip(table.dl.tolist(), table.dh.tolist(), table.pi.tolist(), table.r.tolist()):
+        new_loads, new_profits, new_probabilities = [], [], []
+        for size, probability in ((dl, 1 - pi), (dh, pi)):
+            if probability == 0:
+                continue
+            if profit_model == "sequential":
+                fits = loads + size <= capacity
+                new_loads.append(np.where(fits, loads + size, loads))
+                new_profits.append(profits + np.where(fits, r * size, -penalty * size))
+            else:
+                new_loads.append(loads + size)
+                new_profits.append(profits + (r * size))
+            new_probabilities.append(probabilities * probability)
+        states, inverse = np.unique(np.stack((np.concatenate(new_loads), np.concatenate(new_profits)), axis=1),
+                                    axis=0, return_inverse=True)
+        if len(states) > max_states:
+            raise StateLimitExceeded("Profit distribution exceeded {} states".format(max_states))
+        probabilities = np.bincount(inverse.ravel(), weights=np.concatenate(new_probabilities))
+        loads, profits = states[:, 0], states[:, 1]
+    if profit_model == "overflow":
+        profits = profits - (penalty * np.maximum(loads - capacity, 0))
+    return merge_outcomes(profits, probabilities)
+
+
+def merge_outcomes(profits, probabilities):
+    values, inverse = np.unique(profits, return_inverse=True)
+    return values, np.bincount(inverse.ravel(), weights=probabilities)
+
+
+def value_at_risk(profits, probabilities, alpha):
+    """
+    VaR and CVaR of a discrete profit distribution
+    :param profits: the sorted profit values
+    :param probabilities: their probabilities
+    :param alpha: the risk level
+    :return: VaR, the (1 - alpha) quantile of the profit, and CVaR, the expected profit of the worst (1 - alpha)
+    tail, computed as VaR - E[(VaR - profit)+] / (1 - alpha)
+    """
+    cumulative = np.cumsum(probabilities)
+    var = profits[min(np.searchsorted(cumulative, (1 - alpha) * cumulative[-1] - 1e-12), len(profits) - 1)]
+    cvar = var - (probabilities @ np.maximum(var - profits, 0)) / (1 - alpha)
+    return float(var), float(cvar)
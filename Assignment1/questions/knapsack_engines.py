@@ -0,0 +1,256 @@
+from bisect import bisect_right
+
+import numpy as np
+
+# thresholds of the engine selection in solve_knapsack, see benchmark_knapsack_engines in benchmark.py
+mitm_max_items = 40
+# cost of one enumerated subset of meet-in-the-middle relative to one cell of the Dynamic Programming table
+mitm_subset_cost = 50
+# cost of one branch-and-bound node relative to one cell of the Dynamic Programming table
+bnb_node_cost = 120
+# up to this number of cells the Dynamic Programming is used directly
+dp_direct_max_cells = 10 ** 7
+# default memory budget (bytes) of the Dynamic Programming tables, shared with part2And3.knapsack_dp, see
+# get_memory_budget
+knapsack_memory_budget = 512 * 1024 ** 2
+# fraction of the Dynamic Programming cost that an automatically picked branch-and-bound may spend before the
+# Dynamic Programming is used
+bnb_dp_fraction = 0.1
+
+
+class NodeLimitExceeded(Exception):
+    """
+    Raised by knapsack_branch_and_bound when it explores more nodes than the limit
+    """
+
+
+def get_memory_budget(properties):
+    """
+    :param properties: dictionary with the properties from yaml file
+    :return: the memory budget (bytes) of the knapsack_memory_budget_mb property, knapsack_memory_budget if not set
+    """
+    memory_budget = properties.get("knapsack_memory_budget_mb")
+    return knapsack_memory_budget if memory_budget is None else memory_budget * 1024 ** 2
+
+
+def solve_knapsack(items, capacity, engine="auto", memory_budget=None):
+    """
+    Exact 0/1 knapsack: maximizes the sum of the values of the selected items under the capacity constraint.
+    Three engines are available: a capacity-indexed Dynamic Programming (exact_dp), branch-and-bound with an
+    LP-relaxation bound (branch_and_bound) and meet-in-the-middle (meet_in_the_middle). With engine="auto"
+    the engine is picked from the number of items and the capacity with select_knapsack_engine. An automatically
+    picked branch-and-bound is stopped after the nodes of get_bnb_max_nodes and falls back to the Dynamic
+    Programming, so it costs at most bnb_dp_fraction more than the Dynamic Programming alone.
+    :param items: list of tuples i.e. (value, size, index), where index is the index in the initial list
+    :param capacity: the capacity of the knapsack
+    :param engine: auto, exact_dp, branch_and_bound or meet_in_the_middle
+    :param memory_budget: the memory budget (bytes) of the Dynamic Programming tables for get_bnb_max_nodes, if
+    None knapsack_memory_budget is used
+    :return: sorted list with the 0-based indices of the selected items and the max value
+    """
+    values = [x[0] for x in items]
+    weights = [x[1] for x in items]
+    assert (all(isinstance(val, int) or isinstance(val, float) for val in values))
+    assert (all(isinstance(val, int) and val >= 0 for val in weights))
+    assert (len(items) > 0)
+    assert (isinstance(capacity, int) and capacity > 0)
+    automatic = engine == "auto"
+    if automatic:
+        engine = select_knapsack_engine(len(items), capacity)
+    engines = {"exact_dp": knapsack_exact_dp, "branch_and_bound": knapsack_branch_and_bound,
+               "meet_in_the_middle": knapsack_meet_in_the_middle}
+    if engine not in engines:
+        raise Exception("Unknown knapsack engine {}".format(engine))
+    if engine == "branch_and_bound" and automatic:
+        max_nodes = get_bnb_max_nodes(len(items), capacity, memory_budget)
+        if max_nodes is None:
+            return knapsack_branch_and_bound(values, weights, capacity)
+        try:
+            return knapsack_branch_and_bound(values, weights, capacity, max_nodes=max_nodes)
+        except NodeLimitExceeded:
+            print("Branch-and-bound exceeded {} nodes, using Dynamic Programming".format(max_nodes))
+            engine = "exact_dp"
+    return engines[engine](values, weights, capacity)
+
+
+def select_knapsack_engine(n_items, capacity):
+    """
+    Picks the fastest engine for the given problem size. Meet-in-the-middle is used while the subsets of its
+    larger half, 2^(n - n/2), cost less than the n * capacity cells of the Dynamic Programming table, and the
+    Dynamic Programming while the table has at most dp_direct_max_cells cells. Above it branch-and-bound is
+    picked, as it is the fastest engine on part1-like instances, but it is exponential on strongly correlated
+    instances, so it is limited by get_bnb_max_nodes while the Dynamic Programming fits in memory.
+    :param n_items: the number of items
+    :param capacity: the capacity of the knapsack
+    :return: the name of the engine
+    """
+    cells = n_items * (capacity + 1)
+    if n_items <= mitm_max_items and mitm_subset_cost * 2 ** (n_items - (n_items // 2)) < cells:
+        return "meet_in_the_middle"
+    if cells <= dp_direct_max_cells:
+        return "exact_dp"
+    return "branch_and_bound"
+
+
+def get_bnb_max_nodes(n_items, capacity, memory_budget=None):
+    """
+    The node limit of an automatically picked branch-and-bound: the nodes that cost bnb_dp_fraction of the
+    Dynamic Programming, or no limit if the Dynamic Programming tables (the packed keep table and three float64
+    rows) do not fit in the memory budget
+    :param n_items: the number of items
+    :param capacity: the capacity of the knapsack
+    :param memory_budget: the memory budget in bytes, if None knapsack_memory_budget is used
+    :return: the node limit, None for no limit
+    """
+    memory_budget = knapsack_memory_budget if memory_budget is None else memory_budget
+    if (n_items * ((capacity + 8) // 8)) + (3 * 8 * (capacity + 1)) > memory_budget:
+        return None
+    return max(1, int(bnb_dp_fraction * n_items * (capacity + 1) / bnb_node_cost))
+
+
+def knapsack_exact_dp(values, weights, capacity):
+    """
+    Standard 0/1 knapsack Dynamic Programming over the capacities. Each row is computed with one numpy
+    operation and the keep table is stored packed.
+    :param values: list with the values of the items
+    :param weights: list with the sizes of the items
+    :param capacity: the capacity of the knapsack
+    :return: sorted list with the 0-based indices of the selected items and the max value
+    """
+    n_items = len(values)
+    table = np.zeros(capacity + 1, dtype=np.float64)
+    keep = np.zeros((n_items, (capacity + 8) // 8), dtype=np.uint8)
+    for i in range(n_items):
+        wi = weights[i]
+        if wi > capacity or values[i] <= 0:
+            continue
+        candidate = table[:capacity + 1 - wi] + values[i]
+        keep_row = np.zeros(capacity + 1, dtype=bool)
+        keep_row[wi:] = candidate > table[wi:]
+        table = table.copy()
+        table[wi:] = np.maximum(table[wi:], candidate)
+        keep[i] = np.packbits(keep_row)
+    picks = []
+    remaining_capacity = capacity
+    for i in range(n_items - 1, -1, -1):
+        if (keep[i, remaining_capacity >> 3] >> (7 - (remaining_capacity & 7))) & 1:
+            picks.append(i)
+            remaining_capacity -= weights[i]
+    picks.sort()
+    return picks, float(table[capacity])
+
+
+def knapsack_branch_and_bound(values, weights, capacity, max_nodes=None):
+    """
+    Depth-first branch-and-bound. Items are sorted by value/size ratio and each node is bounded by the
+    LP relaxation (Dantzig bound), i.e. the greedy fill of the remaining capacity with a fractional last item,
+    computed with prefix sums and binary search. Its cost depends on the number of items and the pruning,
+    not on the capacity.
+    :param values: list with the values of the items
+    :param weights: list with the sizes of the items
+    :param capacity: the capacity of the knapsack
+    :param max_nodes: the maximum number of explored nodes, above it NodeLimitExceeded is raised, if None the
+    search is not limited
+    :return: sorted list with the 0-based indices of the selected items and the max value
+    """
+    # items with zero size and positive value are always selected, items without positive value never
+    free = [i for i in range(len(values)) if weights[i] == 0 and values[i] > 0]
+    order = sorted((i for i in range(len(values)) if weights[i] > 0 and values[i] > 0 and weights[i] <= capacity),
+                   key=lambda i: values[i] / weights[i], reverse=True)
+    free_value = sum(values[i] for i in free)
+    v = [values[i] for i in order]
+    w = [weights[i] for i in order]
+    n_items = len(order)
+    prefix_w = [0]
+    prefix_v = [0]
+    for vi, wi in zip(v, w):
+        prefix_w.append(prefix_w[-1] + wi)
+        prefix_v.append(prefix_v[-1] + vi)
+
+    def bound(i, remaining_capacity, value):
+        # the greedy prefix i..k-1 fits, item k (if any) is taken fractionally
+        k = bisect_right(prefix_w, prefix_w[i] + remaining_capacity, lo=i) - 1
+        upper = value + prefix_v[k] - prefix_v[i]
+        if k < n_items:
+            upper += (remaining_capacity - (prefix_w[k] - prefix_w[i])) * v[k] / w[k]
+        return upper
+
+    # greedy incumbent
+    best_value = 0
+    best_picks = None
+    remaining_capacity = capacity
+    for i in range(n_items):
+        if w[i] <= remaining_capacity:
+            remaining_capacity -= w[i]
+            best_value += v[i]
+            best_picks = (i, best_picks)
+    # each stack entry is (next item, remaining capacity, value, picks as a linked list)
+    stack = [(0, capacity, 0, None)]
+    nodes = 0
+    while stack:
+        nodes += 1
+        if max_nodes is not None and nodes > max_nodes:
+            raise NodeLimitExceeded("Branch-and-bound exceeded {} nodes".format(max_nodes))
+        i, remaining_capacity, value, picks = stack.pop()
+        if value > best_value:
+            best_value, best_picks = value, picks
+        if i == n_items or bound(i, remaining_capacity, value) <= best_value:
+            continue
+        # the exclude branch is pushed first so that the include branch is explored first
+        stack.append((i + 1, remaining_capacity, value, picks))
+        if w[i] <= remaining_capacity:
+            stack.append((i + 1, remaining_capacity - w[i], value + v[i], (i, picks)))
+    selected = list(free)
+    while best_picks is not None:
+        selected.append(order[best_picks[0]])
+        best_picks = best_picks[1]
+    selected.sort()
+    return selected, float(best_value + free_value)
+
+
+def knapsack_meet_in_the_middle(values, weights, capacity):
+    """
+    Meet-in-the-middle: the items are split in two halves and all the subsets of each half are enumerated
+    with numpy. The subsets of the second half are sorted by size with a running maximum of the value, so the
+    best completion of every subset of the first half is found with one binary search. The cost is
+    O(2^(n/2) * n) and does not depend on the capacity.
+    :param values: list with the values of the items
+    :param weights: list with the sizes of the items
+    :param capacity: the capacity of the knapsack
+    :return: sorted list with the 0-based indices of the selected items and the max value
+    """
+    n_items = len(values)
+    half = n_items // 2
+    first_values, first_weights = enumerate_subsets(values[:half], weights[:half])
+    second_values, second_weights = enumerate_subsets(values[half:], weights[half:])
+    order = np.argsort(second_weights, kind="stable")
+    sorted_weights = second_weights[order]
+    # running maximum of the value and the subset where it is reached
+    best_second = np.maximum.accumulate(second_values[order])
+    best_second_subset = order[np.maximum.accumulate(np.where(second_values[order] == best_second,
+                                                              np.arange(len(order)), 0))]
+    feasible = np.flatnonzero(first_weights <= capacity)
+    positions = np.searchsorted(sorted_weights, capacity - first_weights[feasible], side="right") - 1
+    totals = first_values[feasible] + best_second[positions]
+    best = int(np.argmax(totals))
+    first_subset = int(feasible[best])
+    second_subset = int(best_second_subset[positions[best]])
+    picks = [j for j in range(half) if (first_subset >> j) & 1]
+    picks += [half + j for j in range(n_items - half) if (second_subset >> j) & 1]
+    return picks, float(totals[best])
+
+
+def enumerate_subsets(values, weights):
+    """
+    Values and sizes of all the subsets of the items. Subset s contains item j if bit j of s is set.
+    :param values: list with the values of the items
+    :param weights: list with the sizes of the items
+    :return: two arrays of length 2^n with the total value and the total size of each subset
+    """
+    subset_values = np.zeros(1, dtype=np.float64)
+    subset_weights = np.zeros(1, dtype=np.int64)
+    for value, weight in zip(values, weights):
+        # subsets with bit j set are the previous subsets plus item j
+        subset_values = np.concatenate((subset_values, subset_values + value))
+        subset_weights = np.concatenate((subset_weights, subset_weights + weight))
+    return subset_values, subset_weights
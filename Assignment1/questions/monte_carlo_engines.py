@@ -0,0 +1,297 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from models.ItemTable import ItemTable
+from models.RunningStatistics import RunningStatistics
+
+# number of runs simulated together, bounds the memory of the (runs x items) matrices
+default_chunk_size = 2 ** 18
+# the runs of parallel_monte_carlo are split in up to parallel_num_blocks blocks of at least
+# parallel_min_block_size runs, each with its own random stream; changing them changes the seeded output
+parallel_num_blocks = 64
+parallel_min_block_size = 2 ** 10
+
+
+def sample_sizes(runs, items, rng=None):
+    """
+    Samples the sizes of the items for all the runs at once. A (runs x items) matrix of uniform random numbers
+    is drawn and the size of an item in a run is dh if its number is smaller than pi and dl otherwise.
+    :param runs: the number of runs
+    :param items: list of Item objects or ItemTable
+    :param rng: the random generator (numpy.random.Generator), if None the global numpy.random state is used
+    :return: the (runs x items) size matrix
+    """
+    table = ItemTable.from_items(items)
+    rng = np.random if rng is None else rng
+    unif = rng.random(size=(int(runs), len(table)))
+    return np.where(unif < table.pi, table.dh, table.dl)
+
+
+def simulate_profits(sizes, items, capacity, penalty):
+    """
+    Computes the profit of every run from its item sizes. The items are added to the knapsack in order and
+    an item that does not fit is excluded and penalized. The fill is sequential over the items but vectorized
+    over the runs: the knapsack load of all runs is kept in one array and a mask per item marks the runs where
+    the item fits. Every run gets the same profit as in part2And3.monte_carlo.
+    :param sizes: the (runs x items) size matrix
+    :param items: list of Item objects or ItemTable
+    :param capacity: the capacity of the knapsack
+    :param penalty: the penalty per size unit of the excluded items
+    :return: array with the profit of each run
+    """
+    table = ItemTable.from_items(items)
+    sizes = np.asarray(sizes)
+    sum_sizes = np.zeros(sizes.shape[0], dtype=sizes.dtype)
+    total_revenue = np.zeros(sizes.shape[0], dtype=np.result_type(sizes.dtype, np.int64))
+    total_size_excluded = np.zeros_like(total_revenue)
+    for j in range(sizes.shape[1]):
+        size = sizes[:, j]
+        fits = sum_sizes + size <= capacity
+        sum_sizes = np.where(fits, sum_sizes + size, sum_sizes)
+        total_revenue += np.where(fits, table.r[j] * size, 0)
+        total_size_excluded += np.where(fits, 0, size)
+    return total_revenue - (penalty * total_size_excluded)
+
+
+def monte_carlo_profits(runs, items, capacity, penalty, rng=None, chunk_size=default_chunk_size):
+    """
+    Vectorized Monte Carlo simulation: samples the sizes and computes the profits in chunks of runs
+    :param runs: the number of runs
+    :param items: list of Item objects or ItemTable with the selected items
+    :param capacity: the capacity of the knapsack
+    :param penalty: the penalty per size unit of the excluded items
+    :param rng: the random generator (numpy.random.Generator), if None the global numpy.random state is used
+    :param chunk_size: the number of runs simulated together
+    :return: array with the profit of each run
+    """
+    table = ItemTable.from_items(items)
+    runs = int(runs)
+    profits = np.empty(runs, dtype=np.int64)
+    for start in range(0, runs, chunk_size):
+        end = min(start + chunk_size, runs)
+        profits[start:end] = simulate_profits(sample_sizes(end - start, table, rng), table, capacity, penalty)
+    return profits
+
+
+def streaming_monte_carlo(items, capacity, penalty, half_width, z=1.96, rng=None, chunk_size=10000, min_runs=1000,
+                          max_runs=10 ** 9):
+    """
+    Streaming Monte Carlo simulation. The runs are simulated in chunks and only the running mean and variance
+    of the profits are kept (RunningStatistics). The simulation stops as soon as the half width of the
+    confidence interval is at most the requested half width, so the memory is constant and no runs are
+    simulated past the requested precision.
+    :param items: list of Item objects or ItemTable with the selected items
+    :param capacity: the capacity of the knapsack
+    :param penalty: the penalty per size unit of the excluded items
+    :param half_width: the target half width of the confidence interval
+    :param z: the quantile of the standard normal distribution for the confidence of the interval
+    :param rng: the random generator (numpy.random.Generator), if None the global numpy.random state is used
+    :param chunk_size: the number of runs simulated between two checks of the stopping rule
+    :param min_runs: the minimum number of runs, so that the variance estimate is reliable
+    :param max_runs: the maximum number of runs
+    :return: the RunningStatistics of the profits
+    """
+    table = ItemTable.from_items(items)
+    statistics = RunningStatistics()
+    while statistics.count < max_runs:
+        runs = min(chunk_size, max_runs - statistics.count)
+        statistics.update(simulate_profits(sample_sizes(runs, table, rng), table, capacity, penalty))
+        if statistics.count >= min_runs and statistics.half_width(z) <= half_width:
+            break
+    return statistics
+
+
+def parallel_monte_carlo(runs, items, capacity, penalty, seed, workers=None, quantiles=None):
+    """
+    Multi-process Monte Carlo simulation. The runs are split in blocks of get_parallel_block_size runs and each
+    block gets its own random stream, spawned from the seed. The blocks are simulated in a process pool and every
+    worker returns partial statistics (count, mean and m2), which are merged in block order. Since the stream of
+    a block depends only on the seed and its position, the result is the same for any number of workers.
+    Optionally, the counts of the profit values are merged as well, to compute exact tail quantiles.
+    The streams use the entropy (seed, 1), so they are independent of the instance generation streams of part1.
+    :param runs: the number of runs
+    :param items: list of Item objects or ItemTable with the selected items
+    :param capacity: the capacity of the knapsack
+    :param penalty: the penalty per size unit of the excluded items
+    :param seed: the root seed
+    :param workers: the number of processes, if None all the available cores are used
+    :param quantiles: list with the requested quantiles (e.g. [0.05] for the 5% tail), if None no quantiles
+    :return: the RunningStatistics of the profits and a dictionary with the quantiles (None without quantiles)
+    """
+    table = ItemTable.from_items(items)
+    runs = int(runs)
+    block_size = get_parallel_block_size(runs)
+    num_blocks = -(-runs // block_size)
+    block_runs = [min(block_size, runs - (b * block_size)) for b in range(num_blocks)]
+    seed_sequences = np.random.SeedSequence([seed, 1]).spawn(num_blocks)
+    arguments = (block_runs, [table] * num_blocks, [capacity] * num_blocks, [penalty] * num_blocks, seed_sequences,
+                 [quantiles is not None] * num_blocks)
+    if workers == 1 or num_blocks <= 1:
+        blocks = list(map(simulate_block, *arguments))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            blocks = list(executor.map(simulate_block, *arguments))
+    statistics = RunningStatistics()
+    for block_statistics, _ in blocks:
+        statistics.merge(block_statistics)
+    if quantiles is None:
+        return statistics, None
+    values, counts = merge_value_counts([block_counts for _, block_counts in blocks])
+    return statistics, quantiles_from_counts(values, counts, quantiles)
+
+
+def get_parallel_block_size(runs):
+    """
+    The block size of parallel_monte_carlo: the runs are split in parallel_num_blocks blocks, so that up to
+    parallel_num_blocks workers are used, unless the blocks would be smaller than parallel_min_block_size runs.
+    It depends only on the number of runs and not on the number of workers, so the seeded result does not either.
+    :param runs: the number of runs
+    :return: the number of runs of a block
+    """
+    return max(parallel_min_block_size, -(-int(runs) // parallel_num_blocks))
+
+
+def simulate_block(runs, items, capacity, penalty, seed_sequence, with_counts=False):
+    """
+    Worker function of parallel_monte_carlo, simulates one block of runs with its own random generator
+    :param runs: the number of runs of the block
+    :param items: ItemTable with the selected items
+    :param capacity: the capacity of the knapsack
+    :param penalty: the penalty per size unit of the excluded items
+    :param seed_sequence: the numpy.random.SeedSequence of the block
+    :param with_counts: boolean variable to return the counts of the profit values
+    :return: the RunningStatistics of the block and the (values, counts) arrays of the profits (or None)
+    """
+    profits = monte_carlo_profits(runs, items, capacity, penalty, rng=np.random.default_rng(seed_sequence))
+    statistics = RunningStatistics()
+    statistics.update(profits)
+    return statistics, np.unique(profits, return_counts=True) if with_counts else None
+
+
+def merge_value_counts(value_counts):
+    """
+    Merges the (values, counts) pairs of several blocks
+    :param value_counts: list with (values, counts) pairs, as returned by numpy.unique
+    :return: the merged (values, counts) pair, sorted by value
+    """
+    values = np.concatenate([values for values, _ in value_counts])
+    counts = np.concatenate([counts for _, counts in value_counts])
+    merged_values, inverse = np.unique(values, return_inverse=True)
+    return merged_values, np.bincount(inverse, weights=counts).astype(np.int64)
+
+
+def quantiles_from_counts(values, counts, quantiles):
+    """
+    Exact quantiles (lower empirical quantile) of the profits from their value counts
+    :param values: the sorted profit values
+    :param counts: the number of runs of each value
+    :param quantiles: list with the requested quantiles
+    :return: dictionary from quantile to profit value
+    """
+    cumulative = np.cumsum(counts)
+    return {q: values[min(np.searchsorted(cumulative, q * cumulative[-1], side="left"), len(values) - 1)].item()
+            for q in quantiles}
+
+
+def variance_reduced_monte_carlo(mode, runs, items, capacity, penalty, rng=None):
+    """
+    Monte Carlo estimation of the expected profit with a variance reduction mode
+    :param mode: crude, antithetic, control_variate or stratified
+    :param runs: the number of runs
+    :param items: list of Item objects or ItemTable with the selected items
+    :param capacity: the capacity of the knapsack
+    :param penalty: the penalty per size unit of the excluded items
+    :param rng: the random generator (numpy.random.Generator), if None the global numpy.random state is used
+    :return: dictionary with the mean, the variance of the mean, the number of runs and the variance reduction
+    factor, i.e. the variance of the crude estimator with the same runs divided by the variance of the mean
+    """
+    estimators = {"crude": crude_monte_carlo, "antithetic": antithetic_monte_carlo,
+                  "control_variate": control_variate_monte_carlo, "stratified": stratified_monte_carlo}
+    if mode not in estimators:
+        raise Exception("Unknown variance reduction mode {}".format(mode))
+    return estimators[mode](int(runs), ItemTable.from_items(items), capacity, penalty, rng)
+
+
+def crude_monte_carlo(runs, table, capacity, penalty, rng=None):
+    """
+    Crude i.i.d. sampling, used as reference of the variance reduction modes
+    :return: see variance_reduced_monte_carlo
+    """
+    profits = simulate_profits(sample_sizes(runs, table, rng), table, capacity, penalty)
+    return {"mean": profits.mean(), "variance": profits.var() / runs, "runs": runs, "variance_reduction": 1.0}
+
+
+def antithetic_monte_carlo(runs, table, capacity, penalty, rng=None):
+    """
+    Antithetic variates: every uniform number u is paired with 1 - u (as in the SAA bonus of part7),
+    the estimator is the mean of the pair averages
+    :return: see variance_reduced_monte_carlo
+    """
+    rng = np.random if rng is None else rng
+    pairs = -(-runs // 2)
+    unif = rng.random(size=(pairs, len(table)))
+    profits = simulate_profits(np.where(unif < table.pi, table.dh, table.dl), table, capacity, penalty)
+    antithetic_profits = simulate_profits(np.where((1 - unif) < table.pi, table.dh, table.dl), table, capacity,
+                                          penalty)
+    pair_means = (profits + antithetic_profits) / 2
+    variance = pair_means.var() / pairs
+    crude_variance = np.concatenate((profits, antithetic_profits)).var() / (2 * pairs)
+    return {"mean": pair_means.mean(), "variance": variance, "runs": 2 * pairs,
+            "variance_reduction": variance_reduction_factor(crude_variance, variance)}
+
+
+def control_variate_monte_carlo(runs, table, capacity, penalty, rng=None):
+    """
+    Control variates: the sizes of the items are used as controls, since their expected values
+    pi * dh + (1 - pi) * dl are known. The coefficients are estimated with least squares and the
+    estimator is the mean of profit - coefficients * (sizes - expected sizes).
+    :return: see variance_reduced_monte_carlo
+    """
+    sizes = sample_sizes(runs, table, rng)
+    profits = simulate_profits(sizes, table, capacity, penalty).astype(np.float64)
+    expected_sizes = (table.pi * table.dh) + ((1 - table.pi) * table.dl)
+    controls = sizes - expected_sizes
+    centered_controls = controls - controls.mean(axis=0)
+    coefficients = np.linalg.lstsq(centered_controls, profits - profits.mean(), rcond=None)[0]
+    adjusted = profits - (controls @ coefficients)
+    variance = adjusted.var() / runs
+    return {"mean": adjusted.mean(), "variance": variance, "runs": runs,
+            "variance_reduction": variance_reduction_factor(profits.var() / runs, variance)}
+
+
+def stratified_monte_carlo(runs, table, capacity, penalty, rng=None, strata_items=3):
+    """
+    Stratified sampling over the dl/dh outcomes of the strata_items items with the largest size variance.
+    Every outcome combination of these items is a stratum with known probability. The runs are allocated
+    proportionally to the probabilities (at least 2 per stratum), the other items are sampled as usual
+    and the estimator is the probability-weighted mean of the stratum means.
+    :param strata_items: the number of items whose outcomes define the strata
+    :return: see variance_reduced_monte_carlo
+    """
+    rng = np.random if rng is None else rng
+    size_variance = table.pi * (1 - table.pi) * ((table.dh - table.dl) ** 2)
+    stratified = np.argsort(-size_variance, kind="stable")[:min(strata_items, len(table))]
+    mean = 0.0
+    variance = 0.0
+    total_runs = 0
+    # mixture moments, for the variance of the crude estimator
+    second_moment = 0.0
+    for pattern in range(2 ** len(stratified)):
+        high = np.array([(pattern >> b) & 1 for b in range(len(stratified))], dtype=bool)
+        probability = np.prod(np.where(high, table.pi[stratified], 1 - table.pi[stratified]))
+        stratum_runs = max(2, int(round(runs * probability)))
+        sizes = np.where(rng.random(size=(stratum_runs, len(table))) < table.pi, table.dh, table.dl)
+        sizes[:, stratified] = np.where(high, table.dh[stratified], table.dl[stratified])
+        profits = simulate_profits(sizes, table, capacity, penalty)
+        mean += probability * profits.mean()
+        variance += (probability ** 2) * profits.var(ddof=1) / stratum_runs
+        second_moment += probability * np.mean(profits.astype(np.float64) ** 2)
+        total_runs += stratum_runs
+    crude_variance = (second_moment - (mean ** 2)) / total_runs
+    return {"mean": mean, "variance": variance, "runs": total_runs,
+            "variance_reduction": variance_reduction_factor(crude_variance, variance)}
+
+
+def variance_reduction_factor(crude_variance, variance):
+    return crude_variance / variance if variance > 0 else np.inf
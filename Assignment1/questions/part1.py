@@ -1,10 +1,16 @@
 import numpy as np
 import os
 import pickle
-from os.path import join
-from models.Item import Item
+from concurrent.futures import ProcessPoolExecutor
+from os.path import join, exists
+from models.ItemTable import ItemTable
 from models.ProblemInstance import ProblemInstance
 
+store_file_name = "problem_instances.npy"
+# number of instances generated from each random stream, changing it changes the seeded output
+generation_block_size = 1000
+store_fields = [("dl", np.int32), ("dh", np.int32), ("pi", np.float64), ("r", np.int32), ("size", np.int32)]
+
 
 def generate_problem_instances(properties):
     """
@@ -13,65 +19,203 @@ def generate_problem_instances(properties):
     In order to decide the item size, we combine dl, dh and their probabilities
     All problem instances are save into a list which is then returned to the main program.
     For poisson and triangular distributions, numpy library is used (numpy.random.poisson and numpy.random.triangular)
-    in order to generate random numbers for the items' sizes.
+    in order to generate random numbers for the items' sizes. The random numbers of all instances are drawn at once
+    by generate_problem_instance_arrays and then converted to ProblemInstance objects.
     :return: a list with all the generated problem instances
     """
-    if problem_instances_exist(properties["problem_instances"], properties["output_folder_name"]):
-        return read_problem_instances(properties["output_folder_name"])
-    problem_instances = []
+    output_folder = properties["output_folder_name"]
+    if problem_instances_exist(properties["problem_instances"], output_folder):
+        return read_problem_instances(output_folder, properties["problem_instances"])
     print("Generating problem instances with items")
-    for i in range(properties["problem_instances"]):
-        instance = ProblemInstance()
-        for j in range(properties["item_nums_per_instance"]):
-            item = Item(j)
-            # calculate pi
-            item.pi = 0.5 + (0.05 * j) - 0.001
-            # calculate d_lj
-            gj = np.random.poisson(lam=(j / 2), size=properties["item_nums_per_instance"])[j]
-            item.dl = int(max(gj, 10))
-            # calculate d_hj
-            item.dh = int(generate_triangular_random_numbers(properties, j)[j])
-            # define item size based on dl, dh and their probabilities
-            item.size = int((item.pi * item.dh) + ((1 - item.pi) * item.dl))
-            # calculate r
-            item.r = 51 - j
-            instance.items.append(item)
-        problem_instances.append(instance)
-        instance_file = join(properties["output_folder_name"], "problem_instance{}".format(i))
-        write_pickle(instance, instance_file)
-    return problem_instances
+    if properties.get("seed") is None:
+        arrays = generate_problem_instance_arrays(num_instances=properties["problem_instances"],
+                                                  num_items=properties["item_nums_per_instance"],
+                                                  group=properties["group"])
+    else:
+        arrays = generate_problem_instance_arrays_parallel(num_instances=properties["problem_instances"],
+                                                           num_items=properties["item_nums_per_instance"],
+                                                           group=properties["group"], seed=properties["seed"],
+                                                           workers=properties.get("generation_workers"))
+    write_problem_instance_store(arrays, join(output_folder, store_file_name))
+    return arrays_to_problem_instances(arrays)
+
+
+def generate_problem_instance_arrays(num_instances, num_items, group, rng=None):
+    """
+    Vectorized generation of problem instances. Instead of building one Item at a time, dl, dh, pi, r and size
+    are drawn for all instances and items at once, with a single numpy.random.poisson and a single
+    numpy.random.triangular call. Item j of every instance uses the same distribution parameters as in
+    generate_problem_instances, so the generated values follow exactly the same distributions.
+    :param num_instances: the number of problem instances to generate
+    :param num_items: the number of items per problem instance
+    :param group: the group param from yaml file
+    :param rng: the random generator to use (numpy.random.Generator), if None the global numpy.random state is used
+    :return: a dictionary with 2-D arrays (instances x items) for dl, dh, pi, r and size
+    """
+    rng = np.random if rng is None else rng
+    shape = (num_instances, num_items)
+    positions = np.arange(num_items)
+    # calculate pi
+    pi = np.broadcast_to(0.5 + (0.05 * positions) - 0.001, shape)
+    # calculate d_lj
+    dl = np.maximum(rng.poisson(lam=(positions / 2), size=shape), 10)
+    # calculate d_hj
+    dh = rng.triangular(left=90 + group - positions, mode=100 + group - positions, right=110 + group - positions,
+                        size=shape).astype(np.int32)
+    # define item size based on dl, dh and their probabilities
+    size = ((pi * dh) + ((1 - pi) * dl)).astype(np.int32)
+    # calculate r
+    r = np.broadcast_to(51 - positions, shape)
+    return {"dl": dl.astype(np.int32), "dh": dh, "pi": np.ascontiguousarray(pi, dtype=np.float64),
+            "r": np.ascontiguousarray(r, dtype=np.int32), "size": size}
+
+
+def generate_problem_instance_arrays_parallel(num_instances, num_items, group, seed, workers=None):
+    """
+    Deterministic parallel version of generate_problem_instance_arrays. The instances are split in blocks of
+    generation_block_size instances and every block gets its own random stream, spawned from the root seed
+    with numpy.random.SeedSequence. The blocks are generated in a process pool and concatenated in order.
+    Since the stream of a block depends only on the root seed and the block position, the output is
+    bit-identical for any number of workers.
+    :param num_instances: the number of problem instances to generate
+    :param num_items: the number of items per problem instance
+    :param group: the group param from yaml file
+    :param seed: the root seed from yaml file
+    :param workers: the number of processes, if None all the available cores are used
+    :return: a dictionary with 2-D arrays (instances x items) for dl, dh, pi, r and size
+    """
+    num_blocks = -(-num_instances // generation_block_size)
+    block_sizes = [min(generation_block_size, num_instances - (b * generation_block_size)) for b in range(num_blocks)]
+    seed_sequences = np.random.SeedSequence(seed).spawn(num_blocks)
+    if workers == 1 or num_blocks <= 1:
+        blocks = list(map(generate_problem_instance_block, block_sizes, [num_items] * num_blocks,
+                          [group] * num_blocks, seed_sequences))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            blocks = list(executor.map(generate_problem_instance_block, block_sizes, [num_items] * num_blocks,
+                                       [group] * num_blocks, seed_sequences))
+    if not blocks:
+        return generate_problem_instance_arrays(0, num_items, group)
+    return {field: np.concatenate([block[field] for block in blocks]) for field, _ in store_fields}
+
+
+def generate_problem_instance_block(num_instances, num_items, group, seed_sequence):
+    """
+    Worker function of generate_problem_instance_arrays_parallel, generates one block of instances
+    with its own random generator
+    :param num_instances: the number of problem instances in the block
+    :param num_items: the number of items per problem instance
+    :param group: the group param from yaml file
+    :param seed_sequence: the numpy.random.SeedSequence of the block
+    :return: a dictionary with the 2-D arrays of the block
+    """
+    return generate_problem_instance_arrays(num_instances, num_items, group, rng=np.random.default_rng(seed_sequence))
+
+
+def arrays_to_problem_instances(arrays):
+    """
+    Converts the arrays produced by generate_problem_instance_arrays to a list of ProblemInstance objects.
+    Each problem instance holds its items as an ItemTable, Item objects are created only by the callers
+    that access the items field.
+    :param arrays: dictionary with 2-D arrays (instances x items) for dl, dh, pi, r and size
+    :return: a list with the problem instances
+    """
+    arrays = {field: np.array(arrays[field], dtype=dtype) for field, dtype in store_fields}
+    return [ProblemInstance(item_table=ItemTable(**{field: values[i] for field, values in arrays.items()}))
+            for i in range(arrays["dl"].shape[0])]
+
+
+def problem_instances_to_arrays(problem_instances):
+    """
+    Inverse of arrays_to_problem_instances. Collects the item tables of all the problem instances
+    in 2-D arrays (instances x items)
+    :param problem_instances: list of ProblemInstance objects with the same number of items
+    :return: a dictionary with 2-D arrays for dl, dh, pi, r and size
+    """
+    tables = [instance.item_table for instance in problem_instances]
+    return {field: np.array([getattr(table, field) for table in tables], dtype=dtype) for field, dtype in store_fields}
+
+
+def write_problem_instance_store(arrays, path):
+    """
+    Writes all the problem instances in a single .npy file. Each record of the file is one problem instance
+    and holds the typed arrays dl, dh, pi, r and size of its items. The .npy header keeps the number of instances
+    and the record layout, so the file can be memory-mapped and any instance can be accessed by its id.
+    :param arrays: dictionary with 2-D arrays (instances x items) for dl, dh, pi, r and size
+    :param path: the path to the store file
+    """
+    num_instances, num_items = arrays["dl"].shape
+    store = np.empty(num_instances, dtype=[(field, dtype, (num_items,)) for field, dtype in store_fields])
+    for field, _ in store_fields:
+        store[field] = arrays[field]
+    np.save(path, store)
+
+
+def read_problem_instance_store(path):
+    """
+    Memory-maps the store written by write_problem_instance_store. No instance is read from the disk
+    until it is accessed.
+    :param path: the path to the store file
+    :return: a dictionary with 2-D memory-mapped arrays (instances x items) for dl, dh, pi, r and size
+    """
+    store = np.load(path, mmap_mode="r")
+    return {field: store[field] for field, _ in store_fields}
+
+
+def read_problem_instance(output_folder, instance_id):
+    """
+    Random access to a single problem instance of the store
+    :param output_folder: the folder where the store is saved
+    :param instance_id: the position of the problem instance
+    :return: the ProblemInstance object
+    """
+    arrays = read_problem_instance_store(join(output_folder, store_file_name))
+    return arrays_to_problem_instances({field: values[instance_id:instance_id + 1]
+                                        for field, values in arrays.items()})[0]
 
 
 def problem_instances_exist(num_problem_instances, output_folder):
-    count = 0
-    for file in os.listdir(output_folder):
-        if "problem_instance" in file:
-            count += 1
-    return True if count >= num_problem_instances else False
+    """
+    Checks if the store holds at least the requested number of problem instances. Problem instances
+    saved with older versions (one pickle file per instance) are migrated to the store.
+    :param num_problem_instances: the requested number of problem instances
+    :param output_folder: the folder where the problem instances are saved
+    :return: True if the problem instances can be read from the store
+    """
+    store_file = join(output_folder, store_file_name)
+    if not exists(store_file):
+        migrate_pickled_problem_instances(output_folder)
+    if not exists(store_file):
+        return False
+    return read_problem_instance_store(store_file)["dl"].shape[0] >= num_problem_instances
 
 
-def read_problem_instances(output_folder):
-    problem_instances = []
-    for file in os.listdir(output_folder):
-        if "problem_instance" in file:
-            problem_instance = load_pickle(join(output_folder, file))
-            problem_instances.append(problem_instance)
-    return problem_instances
+def read_problem_instances(output_folder, num_problem_instances=None):
+    """
+    Reads the problem instances from the store, ordered by their id
+    :param output_folder: the folder where the problem instances are saved
+    :param num_problem_instances: read only the first num_problem_instances, if None all instances are read
+    :return: a list with the problem instances
+    """
+    arrays = read_problem_instance_store(join(output_folder, store_file_name))
+    return arrays_to_problem_instances({field: values[:num_problem_instances] for field, values in arrays.items()})
 
 
-def generate_triangular_random_numbers(properties, item_iteration):
+def migrate_pickled_problem_instances(output_folder):
     """
-    Method that generates random numbers using triangular distribution.
-    Left, mode and right parameters are calculated and provided in numpy.random.triangular
-    to generate an array with the relevant random numbers
-    :param item_iteration: the iterator's index (position of the item)
-    :param properties properties from yaml file
-    :return: nd array with the random numbers
+    Converts the problem_instance{i} pickle files of older versions to the store, keeping the instance order
+    :param output_folder: the folder where the problem instances are saved
     """
-    left = 90 + properties["group"] - item_iteration
-    mode = 100 + properties["group"] - item_iteration
-    right = 110 + properties["group"] - item_iteration
-    return np.random.triangular(left=left, mode=mode, right=right, size=properties["item_nums_per_instance"])
+    pickled = {}
+    for file in os.listdir(output_folder):
+        instance_id = file[len("problem_instance"):]
+        if file.startswith("problem_instance") and instance_id.isdigit():
+            pickled[int(instance_id)] = join(output_folder, file)
+    if not pickled:
+        return
+    print("Migrating {} pickled problem instances to {}".format(len(pickled), store_file_name))
+    problem_instances = [load_pickle(pickled[i]) for i in sorted(pickled)]
+    write_problem_instance_store(problem_instances_to_arrays(problem_instances), join(output_folder, store_file_name))
 
 
 def load_pickle(path):
@@ -82,13 +226,3 @@ def load_pickle(path):
     """
     with open(path, "rb") as f:
         return pickle.load(f)
-
-
-def write_pickle(o, path):
-    """
-    Write an object to file with pickle library
-    :param o: the object
-    :param path: path to file
-    """
-    with open(path, "wb") as f:
-        return pickle.dump(o, f)
@@ -1,8 +1,11 @@
+from os.path import join
+
 import numpy as np
-from models.Item import Item
+from models.ItemTable import ItemTable
 from models.MonteCarloSim import MonteCarloSim
 from scipy import stats
 
+from questions import exact_evaluation, knapsack_engines, monte_carlo_engines
 
 def run_knapsack_for_problem_instance(instance, properties):
     """
@@ -16,13 +19,61 @@ def run_knapsack_for_problem_instance(instance, properties):
     :param properties: properties read from yaml file
     """
     print("Executing Knapsack problem")
-    items = reform_items(instance.items)
-    best_value = knapsack_dp(items, properties["capacity"], return_all=True)
-    selected_items, total_revenue = get_knapsack_result(best_value, instance.items)
+    items = reform_items(instance.item_table)
+    engine = properties.get("knapsack_engine", "dp")
+    memory_budget = knapsack_engines.get_memory_budget(properties)
+    if engine == "dp":
+        best_value = knapsack_dp(items, properties["capacity"], return_all=True, memory_budget=memory_budget)
+    else:
+        best_value = knapsack_engines.solve_knapsack(get_exact_knapsack_items(items), properties["capacity"],
+                                                     engine=engine, memory_budget=memory_budget)
+    selected_items, total_revenue = get_knapsack_result(best_value, instance.item_table)
+    if properties.get("capacity_sweep"):
+        run_knapsack_capacity_sweep(items, properties["capacity_sweep"], engine, memory_budget)
+    if properties.get("exact_evaluation"):
+        run_exact_evaluation(properties=properties, selected_items=selected_items)
     print("Running monte carlo simulation for a small number of runs")
     sn_small_run = run_small_monte_carlo(properties=properties, selected_items=selected_items)
     if properties["run_full_runs_monte_carlo"]:
-        run_full_monte_carlo(properties=properties, selected_items=selected_items, sn_small_run=sn_small_run)
+        monte_carlo_mode = properties.get("monte_carlo_mode", "full")
+        if monte_carlo_mode == "streaming":
+            run_streaming_monte_carlo(properties=properties, selected_items=selected_items, sn_small_run=sn_small_run)
+        elif monte_carlo_mode == "parallel":
+            run_parallel_monte_carlo(properties=properties, selected_items=selected_items)
+        elif monte_carlo_mode in ("antithetic", "control_variate", "stratified"):
+            run_variance_reduced_monte_carlo(properties=properties, selected_items=selected_items,
+                                             mode=monte_carlo_mode)
+        else:
+            run_full_monte_carlo(properties=properties, selected_items=selected_items, sn_small_run=sn_small_run)
+
+
+def run_exact_evaluation(properties, selected_items):
+    """
+    Prints the exact expected profit of the selected items (sequential profit model, the same as the Monte Carlo
+    simulation) and, with exact_evaluation_risk, their VaR and CVaR at the first CVaR risk of the properties.
+    The VaR and CVaR need the whole profit distribution, whose number of states can grow exponentially with the
+    number of items; above exact_evaluation_max_states states they are skipped.
+    :param properties: properties read from yaml file
+    :param selected_items: list of Item objects or ItemTable with the selected items
+    :return: the result dictionary of exact_evaluation.evaluate_selection, var and cvar are None if not computed
+    """
+    result = exact_evaluation.evaluate_selection(selected_items, properties["capacity"], properties["penalty"],
+                                                 alpha=None)
+    result["var"], result["cvar"] = None, None
+    print("Exact expected profit is {}".format(result["expected_profit"]))
+    if not properties.get("exact_evaluation_risk", False):
+        return result
+    alpha = properties["risks"]["cvar"][0]
+    try:
+        profits, probabilities = exact_evaluation.exact_profit_distribution(
+            selected_items, properties["capacity"], properties["penalty"],
+            max_states=properties.get("exact_evaluation_max_states"))
+    except exact_evaluation.StateLimitExceeded as e:
+        print("Exact VaR and CVaR are not computed: {}".format(e))
+        return result
+    result["var"], result["cvar"] = exact_evaluation.value_at_risk(profits, probabilities, alpha)
+    print("Exact VaR and CVaR for risk {} are {} and {}".format(alpha, result["var"], result["cvar"]))
+    return result
 
 # ================================== Knapsack Algorithm ================================================= #
 
@@ -30,21 +81,27 @@ def run_knapsack_for_problem_instance(instance, properties):
 def reform_items(items):
     """
     Creates list of tuples with the values, sizes and indices of the items provided
-    :param items: list of Item objects
+    :param items: list of Item objects or ItemTable
     :return: list of tuples
     """
+    if isinstance(items, ItemTable):
+        return list(zip(items.r.tolist(), items.size.tolist(), items.position.tolist()))
     new_items = []
     for j in range(len(items)):
         new_items.append((items[j].r, items[j].size, items[j].position))
     return new_items
 
 
-def knapsack_dp(items, capacity, return_all=False):
+def knapsack_dp(items, capacity, return_all=False, memory_budget=None):
     """
-    Knapsack problem using Dynamic Programming
+    Knapsack problem using Dynamic Programming. If the tables of the dense engine (fill_knapsack_table)
+    do not fit in memory_budget, the low memory engine (knapsack_dp_low_memory) is used, which returns
+    the same result.
     :param items: list of tuples i.e. (value, size, index), where index is the index in the initial list
     :param capacity: the capacity of the knapsack
     :param return_all: boolean variable to return the max value and the items or only the items
+    :param memory_budget: the memory budget of the tables in bytes, if None knapsack_engines.knapsack_memory_budget
+    is used
     :return: based on return_all value return the items and the max value
     """
     values = [x[0] for x in items]
@@ -52,37 +109,298 @@ def knapsack_dp(items, capacity, return_all=False):
     n_items = len(items)
     check_inputs(values, weights, n_items, capacity)
 
-    table = np.zeros((n_items + 1, capacity + 1), dtype=np.float32)
-    keep = np.zeros((n_items + 1, capacity + 1), dtype=np.float32)
+    memory_budget = knapsack_engines.knapsack_memory_budget if memory_budget is None else memory_budget
+    if dense_knapsack_memory(n_items, capacity) > memory_budget:
+        picks, max_val = knapsack_dp_low_memory(values, weights, capacity, memory_budget)
+    else:
+        table, keep = fill_knapsack_table(values, weights, capacity)
+        picks = get_knapsack_picks(keep, weights, capacity)
+        max_val = table[capacity]
+
+    if return_all:
+        return picks, max_val
+    return picks
+
+
+def dense_knapsack_memory(n_items, capacity):
+    """
+    Estimates the peak memory of fill_knapsack_table, i.e. the packed keep table and the rows of fill_knapsack_row
+    :param n_items: the number of items
+    :param capacity: the capacity of the knapsack
+    :return: the memory in bytes
+    """
+    return ((n_items + 1) * ((capacity + 8) // 8)) + knapsack_row_memory(capacity)
+
+
+def knapsack_row_memory(capacity):
+    """
+    Estimates the peak memory of fill_knapsack_row: the previous and the new float32 rows, two float32
+    temporaries of np.where and the boolean keep row and comparison
+    :param capacity: the capacity of the knapsack
+    :return: the memory in bytes
+    """
+    return ((4 * 4) + 2) * (capacity + 1)
+
+
+def low_memory_knapsack_memory(n_items, capacity, block_size):
+    """
+    Estimates the peak memory of knapsack_dp_low_memory: a float32 checkpoint row per block, the packed keep rows
+    of one block and the rows of fill_knapsack_row
+    :param n_items: the number of items
+    :param capacity: the capacity of the knapsack
+    :param block_size: the number of items of a block, one or an array of sizes
+    :return: the memory in bytes
+    """
+    num_blocks = -(-n_items // block_size)
+    return (num_blocks * 4 * (capacity + 1)) + (block_size * ((capacity + 8) // 8)) + knapsack_row_memory(capacity)
+
+
+def get_low_memory_block_size(n_items, capacity, memory_budget=None):
+    """
+    The block size of knapsack_dp_low_memory: the largest one (fewest checkpoint rows) whose memory fits in the
+    budget, or the one with the least memory if none fits
+    :param n_items: the number of items
+    :param capacity: the capacity of the knapsack
+    :param memory_budget: the memory budget in bytes, if None knapsack_engines.knapsack_memory_budget is used
+    :return: the block size
+    """
+    memory_budget = knapsack_engines.knapsack_memory_budget if memory_budget is None else memory_budget
+    block_sizes = np.arange(1, max(n_items, 1) + 1)
+    memory = low_memory_knapsack_memory(n_items, capacity, block_sizes)
+    fits = np.flatnonzero(memory <= memory_budget)
+    if len(fits) == 0:
+        print("The knapsack needs at least {} bytes, above the memory budget of {} bytes".format(memory.min(),
+                                                                                               memory_budget))
+        return int(block_sizes[np.argmin(memory)])
+    return int(block_sizes[fits[-1]])
+
+
+def fill_knapsack_row(table, vi, wi):
+    """
+    Computes the next row of the Dynamic Programming table with one numpy operation over the
+    previous row shifted by the weight of the current item
+    :param table: the previous row of the table
+    :param vi: the value of the current item
+    :param wi: the weight of the current item
+    :return: the next row and the boolean keep row
+    """
+    capacity = len(table) - 1
+    keep_row = np.zeros(capacity + 1, dtype=bool)
+    if wi > capacity:
+        return table, keep_row
+    # table[w - wi] for every w >= wi
+    shifted = table[:capacity + 1 - wi]
+    keep_row[wi:] = (shifted + np.float32(vi)) > table[wi:]
+    new_table = table.copy()
+    new_table[wi:] = np.where(keep_row[wi:], np.float32(vi * wi) + shifted, table[wi:])
+    return new_table, keep_row
+
 
+def fill_knapsack_table(values, weights, capacity):
+    """
+    Fills the Dynamic Programming table row by row with fill_knapsack_row, so only the previous row is kept
+    in memory. The keep table is stored packed, i.e. one bit per (item, capacity) pair.
+    :param values: list with the values of the items
+    :param weights: list with the sizes of the items
+    :param capacity: the capacity of the knapsack
+    :return: the last row of the table (best value for every capacity 0..capacity) and the packed keep table
+    """
+    n_items = len(values)
+    table = np.zeros(capacity + 1, dtype=np.float32)
+    keep = np.zeros((n_items + 1, (capacity + 8) // 8), dtype=np.uint8)
     for i in range(1, n_items + 1):
-        for w in range(0, capacity + 1):
-            wi = weights[i - 1]  # weight of current item
-            vi = values[i - 1]  # value of current item
-            if (wi <= w) and (vi + table[i - 1, w - wi] > table[i - 1, w]):
-                table[i, w] = (vi * wi) + table[i - 1, w - wi]
-                keep[i, w] = 1
-            else:
-                table[i, w] = table[i - 1, w]
+        table, keep_row = fill_knapsack_row(table, values[i - 1], weights[i - 1])
+        keep[i] = np.packbits(keep_row)
+    return table, keep
+
+
+def knapsack_dp_low_memory(values, weights, capacity, memory_budget=None):
+    """
+    Low memory version of the Dynamic Programming with checkpointed reconstruction. The forward pass keeps
+    only the current row and a checkpoint row every block_size items. The selection is then reconstructed
+    block by block, from the last to the first, by recomputing the rows of a block from its checkpoint and
+    keeping the packed keep rows of this block only. Each row is computed at most twice. The block size is
+    chosen from the memory budget with get_low_memory_block_size; the least memory, about
+    O(capacity * sqrt(n_items)) instead of O(capacity * n_items), is at a block size of about sqrt(32 * n_items).
+    The recurrence is the same as in fill_knapsack_table, so the picks and the max value are identical.
+    :param values: list with the values of the items
+    :param weights: list with the sizes of the items
+    :param capacity: the capacity of the knapsack
+    :param memory_budget: the memory budget in bytes, if None knapsack_engines.knapsack_memory_budget is used
+    :return: sorted list with the 0-based indices of the selected items and the max value
+    """
+    n_items = len(values)
+    block_size = get_low_memory_block_size(n_items, capacity, memory_budget)
+    table = np.zeros(capacity + 1, dtype=np.float32)
+    checkpoints = {}
+    for i in range(n_items):
+        if i % block_size == 0:
+            checkpoints[i] = table
+        table, _ = fill_knapsack_row(table, values[i], weights[i])
+    max_val = table[capacity]
 
     picks = []
     remaining_capacity = capacity
+    for block_start in sorted(checkpoints, reverse=True):
+        block_end = min(block_start + block_size, n_items)
+        table = checkpoints.pop(block_start)
+        keep = np.zeros((block_end - block_start, (capacity + 8) // 8), dtype=np.uint8)
+        for i in range(block_start, block_end):
+            table, keep_row = fill_knapsack_row(table, values[i], weights[i])
+            keep[i - block_start] = np.packbits(keep_row)
+        for i in range(block_end - 1, block_start - 1, -1):
+            if (keep[i - block_start, remaining_capacity >> 3] >> (7 - (remaining_capacity & 7))) & 1:
+                picks.append(i)
+                remaining_capacity -= weights[i]
+    picks.sort()
+    return picks, max_val
 
-    for i in range(n_items, 0, -1):
-        if keep[i, remaining_capacity] == 1:
-            picks.append(i)
-            remaining_capacity -= weights[i - 1]
 
+def get_knapsack_picks(keep, weights, capacity):
+    """
+    Reconstructs the selected items from the packed keep table
+    :param keep: the packed keep table returned by fill_knapsack_table
+    :param weights: list with the sizes of the items
+    :param capacity: the capacity of the knapsack
+    :return: sorted list with the 0-based indices of the selected items
+    """
+    picks = []
+    remaining_capacity = capacity
+    for i in range(len(weights), 0, -1):
+        if (keep[i, remaining_capacity >> 3] >> (7 - (remaining_capacity & 7))) & 1:
+            picks.append(i - 1)
+            remaining_capacity -= weights[i - 1]
     picks.sort()
-    picks = [x - 1 for x in picks]  # change to 0-index
-
-    if return_all:
-        max_val = table[n_items, capacity]
-        return picks, max_val
     return picks
 
 
+def knapsack_dp_sweep(items, capacities):
+    """
+    Solves the knapsack problem for a list of capacities with one Dynamic Programming pass. The table is filled
+    up to the largest capacity, its last row holds the best value for every smaller capacity and the keep table
+    is used to reconstruct the selection of each capacity.
+    :param items: list of tuples i.e. (value, size, index), where index is the index in the initial list
+    :param capacities: list with the capacities of the knapsack
+    :return: list with a (picks, max value) tuple for each capacity, as returned by knapsack_dp with return_all
+    """
+    values = [x[0] for x in items]
+    weights = [x[1] for x in items]
+    max_capacity = max(capacities)
+    check_inputs(values, weights, len(items), max_capacity)
+    assert (all(isinstance(capacity, int) and capacity > 0 for capacity in capacities))
+
+    table, keep = fill_knapsack_table(values, weights, max_capacity)
+    return [(get_knapsack_picks(keep, weights, capacity), table[capacity]) for capacity in capacities]
+
+
+def run_knapsack_capacity_sweep(items, capacities, engine="dp", memory_budget=None):
+    """
+    Prints the knapsack result for each capacity of the capacity_sweep property, with the knapsack_engine of the
+    main result: one pass of knapsack_dp_sweep for dp, one solve per capacity for the exact engines
+    :param items: list of tuples i.e. (value, size, index)
+    :param capacities: list with the capacities of the knapsack
+    :param engine: dp or an engine of knapsack_engines.solve_knapsack
+    :param memory_budget: the memory budget in bytes of knapsack_engines.solve_knapsack
+    """
+    if engine == "dp":
+        results = knapsack_dp_sweep(items, capacities)
+    else:
+        exact_items = get_exact_knapsack_items(items)
+        results = [knapsack_engines.solve_knapsack(exact_items, capacity, engine=engine, memory_budget=memory_budget)
+                   for capacity in capacities]
+    print("Knapsack capacity sweep ({} engine)".format(engine))
+    print("=========================================")
+    print("Capacity\tTotal revenue\tSelected items")
+    for capacity, (picks, max_val) in zip(capacities, results):
+        print("{}\t\t{}\t\t{}".format(capacity, max_val, picks))
+    print("=========================================")
+
+
+def get_exact_knapsack_items(items):
+    """
+    The exact engines maximize the total revenue, i.e. the sum of revenue * size of the selected items
+    :param items: list of tuples i.e. (value, size, index)
+    :return: list of tuples i.e. (revenue * size, size, index)
+    """
+    return [(r * size, size, position) for r, size, position in items]
+
+
+def knapsack_dp_batch(revenues, sizes, capacity, chunk_size=4096):
+    """
+    Solves the knapsack problem of many problem instances together. The Dynamic Programming table has one row
+    per instance and each item is added to all the instances with one numpy operation, so the result of every
+    instance is the same as the result of knapsack_dp for this instance.
+    :param revenues: 2-D array (instances x items) with the values of the items
+    :param sizes: 2-D array (instances x items) with the sizes of the items
+    :param capacity: the capacity of the knapsack
+    :param chunk_size: the number of instances solved together, bounds the memory of the index arrays
+    :return: boolean 2-D array (instances x items) with the picks and array with the max value of each instance
+    """
+    revenues = np.asarray(revenues)
+    sizes = np.asarray(sizes)
+    assert (revenues.ndim == 2 and revenues.shape == sizes.shape)
+    assert (np.issubdtype(sizes.dtype, np.integer) and np.all(sizes >= 0))
+    assert (revenues.shape[1] > 0)
+    assert (isinstance(capacity, int) and capacity > 0)
+    picks = np.zeros(revenues.shape, dtype=bool)
+    max_values = np.zeros(revenues.shape[0], dtype=np.float32)
+    for start in range(0, revenues.shape[0], chunk_size):
+        end = start + chunk_size
+        picks[start:end], max_values[start:end] = solve_knapsack_chunk(revenues[start:end], sizes[start:end],
+                                                                       capacity)
+    return picks, max_values
+
+
+def solve_knapsack_chunk(revenues, sizes, capacity):
+    """
+    Solves a chunk of instances for knapsack_dp_batch
+    :param revenues: 2-D array (instances x items) with the values of the items
+    :param sizes: 2-D array (instances x items) with the sizes of the items
+    :param capacity: the capacity of the knapsack
+    :return: the picks and the max values of the chunk
+    """
+    n_instances, n_items = sizes.shape
+    rows = np.arange(n_instances)
+    capacities = np.arange(capacity + 1)
+    table = np.zeros((n_instances, capacity + 1), dtype=np.float32)
+    keep = np.zeros((n_items, n_instances, (capacity + 8) // 8), dtype=np.uint8)
+    for i in range(n_items):
+        wi = sizes[:, i, None]
+        vi = revenues[:, i, None].astype(np.float32)
+        fits = capacities >= wi
+        # table[w - wi] for every instance, capacities smaller than wi are masked by fits
+        shifted = np.take_along_axis(table, np.maximum(capacities - wi, 0), axis=1)
+        keep_rows = fits & ((shifted + vi) > table)
+        table = np.where(keep_rows, (revenues[:, i, None] * wi).astype(np.float32) + shifted, table)
+        keep[i] = np.packbits(keep_rows, axis=1)
+    picks = np.zeros((n_instances, n_items), dtype=bool)
+    remaining_capacity = np.full(n_instances, capacity)
+    for i in range(n_items - 1, -1, -1):
+        picks[:, i] = (keep[i, rows, remaining_capacity >> 3] >> (7 - (remaining_capacity & 7))) & 1
+        remaining_capacity -= picks[:, i] * sizes[:, i]
+    return picks, table[:, capacity]
+
+
+def knapsack_for_problem_instances(problem_instances, capacity):
+    """
+    Runs knapsack_dp_batch for a list of problem instances with the same number of items
+    :param problem_instances: list of ProblemInstance objects
+    :param capacity: the capacity of the knapsack
+    :return: list with the picks (0-based indices) and array with the max value of each instance
+    """
+    tables = [instance.item_table for instance in problem_instances]
+    picks, max_values = knapsack_dp_batch(np.array([table.r for table in tables]),
+                                          np.array([table.size for table in tables]), capacity)
+    return [np.flatnonzero(row).tolist() for row in picks], max_values
+
+
 def get_knapsack_result(best_value, items):
+    """
+    Prints the knapsack result and marks the selected items
+    :param best_value: the picks and the max value returned by knapsack_dp
+    :param items: list of Item objects or ItemTable
+    :return: the selected items (list of Item objects or ItemTable respectively) and the total revenue
+    """
     item_indices = best_value[0]
     total_revenue = best_value[1]
     print("Knapsack result")
@@ -90,6 +408,8 @@ def get_knapsack_result(best_value, items):
     print("Selected items ", item_indices)
     print("Total revenue: {}".format(total_revenue))
     print("=========================================")
+    if isinstance(items, ItemTable):
+        return items.select(item_indices), total_revenue
     for i, item in enumerate(items):
         if i in item_indices:
             item.decision_variable = 1
@@ -118,7 +438,9 @@ def check_inputs(values, weights, n_items, capacity):
 
 def run_small_monte_carlo(properties, selected_items):
     monte_carlo_runs = properties["small_run_monte_carlo"]
-    profits = monte_carlo(monte_carlo_runs, selected_items, properties["capacity"], properties["penalty"])
+    profits = monte_carlo(monte_carlo_runs, selected_items, properties["capacity"], properties["penalty"],
+                          trace=properties.get("monte_carlo_trace", "print"),
+                          trace_file=join(properties["output_folder_name"], "monte_carlo_trace_small.npz"))
     m = np.mean(profits)
     print("Profit mean is {}".format(m))
 
@@ -133,7 +455,9 @@ def run_small_monte_carlo(properties, selected_items):
 def run_full_monte_carlo(properties, selected_items, sn_small_run):
     monte_carlo_runs = (1 / (10 ** -properties["accuracy"])) ** 2
     print("Running monte carlo simulation for runs {}".format(int(monte_carlo_runs)))
-    profits = monte_carlo(monte_carlo_runs, selected_items, properties["capacity"], properties["penalty"])
+    profits = monte_carlo(monte_carlo_runs, selected_items, properties["capacity"], properties["penalty"],
+                          trace=properties.get("monte_carlo_trace", "print"),
+                          trace_file=join(properties["output_folder_name"], "monte_carlo_trace_full.npz"))
     m = np.mean(profits)
     print("Profit mean is {}".format(m))
 
@@ -144,46 +468,149 @@ def run_full_monte_carlo(properties, selected_items, sn_small_run):
     print("Confidence interval is {}".format(ci))
 
 
-def monte_carlo(runs, selected_items, capacity, penalty):
-    # monte carlo
-    monte_carlo_runs = []
-    profits = []
-    for i in range(int(runs)):
-        monte_carlo_sim = MonteCarloSim(i)
-        new_items = []
-        for j, old_item in enumerate(selected_items):
-            item = Item(j)
-            item.copy_item(old_item)
-            unif = stats.uniform(0, 1).rvs(1)
-            item.size = item.dh if unif[0] < item.pi else item.dl
-            new_items.append(item)
-        sum_sizes = 0
-        total_revenue = 0
-        count_oversize = 0
-        total_size_excluded = 0
-        for j, item in enumerate(new_items):
-            if sum_sizes + item.size <= capacity:
-                sum_sizes += item.size
-                total_revenue += item.r * item.size
-            else:
-                count_oversize += 1
-                total_size_excluded += item.size
-        run_profit = total_revenue - (penalty * total_size_excluded)
-        monte_carlo_sim.items = new_items
-        monte_carlo_sim.profit = run_profit
-        monte_carlo_runs.append(monte_carlo_sim)
-        profits.append(run_profit)
-    print_monte_carlo_result(monte_carlo_runs)
+def run_streaming_monte_carlo(properties, selected_items, sn_small_run):
+    """
+    Runs the streaming Monte Carlo simulation until the confidence interval reaches the target half width.
+    If monte_carlo_half_width is not set, the target is the half width that the full run is expected to reach,
+    i.e. z * sn_small_run * 10^-accuracy.
+    :param properties: properties read from yaml file
+    :param selected_items: list of Item objects or ItemTable with the selected items
+    :param sn_small_run: the standard deviation of the small run
+    :return: the RunningStatistics of the profits
+    """
+    z = stats.norm.ppf((1 + properties["confidence_interval"]) / 2)
+    half_width = properties.get("monte_carlo_half_width")
+    if half_width is None:
+        half_width = z * sn_small_run * (10 ** -properties["accuracy"])
+    print("Running streaming monte carlo simulation until the half width is {}".format(half_width))
+    statistics = monte_carlo_engines.streaming_monte_carlo(selected_items, properties["capacity"],
+                                                           properties["penalty"], half_width=half_width, z=z)
+    print("Monte carlo simulation stopped after {} runs".format(statistics.count))
+    print("Profit mean is {}".format(statistics.mean))
+    half_width = statistics.half_width(z)
+    ci = (statistics.mean - half_width, statistics.mean + half_width)
+    print("Confidence interval is {}".format(ci))
+    return statistics
+
+
+def run_parallel_monte_carlo(properties, selected_items):
+    """
+    Runs the same number of runs as run_full_monte_carlo in a process pool and prints the merged mean
+    and confidence interval. The runs are reproducible from the seed property for any number of workers.
+    :param properties: properties read from yaml file
+    :param selected_items: list of Item objects or ItemTable with the selected items
+    :return: the RunningStatistics of the profits
+    """
+    monte_carlo_runs = (1 / (10 ** -properties["accuracy"])) ** 2
+    seed = properties.get("seed")
+    if seed is None:
+        seed = np.random.SeedSequence().entropy
+        print("No seed in properties, using seed {}".format(seed))
+    print("Running parallel monte carlo simulation for runs {}".format(int(monte_carlo_runs)))
+    statistics, quantiles = monte_carlo_engines.parallel_monte_carlo(monte_carlo_runs, selected_items,
+                                                                     properties["capacity"], properties["penalty"],
+                                                                     seed=seed,
+                                                                     workers=properties.get("monte_carlo_workers"),
+                                                                     quantiles=properties.get("monte_carlo_quantiles"))
+    print("Profit mean is {}".format(statistics.mean))
+    half_width = 1.96 * statistics.std() / np.sqrt(statistics.count)
+    ci = (statistics.mean - half_width, statistics.mean + half_width)
+    print("Confidence interval is {}".format(ci))
+    if quantiles:
+        for q, value in quantiles.items():
+            print("Profit {} quantile is {}".format(q, value))
+    return statistics
+
+
+def run_variance_reduced_monte_carlo(properties, selected_items, mode):
+    """
+    Runs Monte Carlo simulation with a variance reduction mode. A pilot run estimates the variance reduction
+    factor of the mode, so the final run needs only (10^accuracy)^2 / factor runs to reach the precision
+    of the full run.
+    :param properties: properties read from yaml file
+    :param selected_items: list of Item objects or ItemTable with the selected items
+    :param mode: antithetic, control_variate or stratified
+    :return: the result dictionary of monte_carlo_engines.variance_reduced_monte_carlo
+    """
+    full_runs = (1 / (10 ** -properties["accuracy"])) ** 2
+    pilot = monte_carlo_engines.variance_reduced_monte_carlo(mode, max(properties["small_run_monte_carlo"], 1000),
+                                                             selected_items, properties["capacity"],
+                                                             properties["penalty"])
+    print("Variance reduction factor of {} pilot run is {}".format(mode, pilot["variance_reduction"]))
+    runs = max(int(np.ceil(full_runs / pilot["variance_reduction"])), properties["small_run_monte_carlo"])
+    print("Running {} monte carlo simulation for runs {} instead of {}".format(mode, runs, int(full_runs)))
+    result = monte_carlo_engines.variance_reduced_monte_carlo(mode, runs, selected_items, properties["capacity"],
+                                                              properties["penalty"])
+    print("Profit mean is {}".format(result["mean"]))
+    half_width = 1.96 * np.sqrt(result["variance"])
+    ci = (result["mean"] - half_width, result["mean"] + half_width)
+    print("Confidence interval is {}".format(ci))
+    print("Variance reduction factor is {}".format(result["variance_reduction"]))
+    return result
+
+
+def monte_carlo(runs, selected_items, capacity, penalty, trace="print", trace_file=None):
+    """
+    Monte Carlo simulation of the selected items. In each run the size of every item is dh with probability pi
+    and dl otherwise. Items are added to the knapsack in order and each item that does not fit is penalized.
+    The runs are simulated with the vectorized engine of monte_carlo_engines.
+    :param runs: the number of runs
+    :param selected_items: list of Item objects or ItemTable with the selected items
+    :param capacity: the capacity of the knapsack
+    :param penalty: the penalty per size unit of the excluded items
+    :param trace: print (print every run), file (write the runs to trace_file) or summary (no trace)
+    :param trace_file: the path of the trace file
+    :return: array with the profit of each run
+    """
+    table = ItemTable.from_items(selected_items)
+    sizes = monte_carlo_engines.sample_sizes(runs, table)
+    profits = monte_carlo_engines.simulate_profits(sizes, table, capacity, penalty)
+    if trace == "file":
+        write_monte_carlo_trace(trace_file, table.position, sizes, profits)
+    elif trace == "print":
+        positions = table.position.tolist()
+        monte_carlo_runs = []
+        for i, (run_sizes, run_profit) in enumerate(zip(sizes.tolist(), profits.tolist())):
+            monte_carlo_sim = MonteCarloSim(i)
+            monte_carlo_sim.positions = positions
+            monte_carlo_sim.sizes = run_sizes
+            monte_carlo_sim.profit = run_profit
+            monte_carlo_runs.append(monte_carlo_sim)
+        print_monte_carlo_result(monte_carlo_runs)
     return profits
 
 
+def write_monte_carlo_trace(path, positions, sizes, profits):
+    """
+    Writes the Monte Carlo runs in a binary columnar file (.npz) with the arrays run (run ids),
+    positions (item positions), sizes (runs x items size matrix) and profit
+    :param path: the path of the trace file
+    :param positions: the positions of the simulated items
+    :param sizes: the (runs x items) size matrix
+    :param profits: the profit of each run
+    """
+    print("Writing monte carlo trace to {}".format(path))
+    np.savez(path, run=np.arange(len(profits)), positions=np.asarray(positions), sizes=np.asarray(sizes),
+             profit=np.asarray(profits))
+
+
+def read_monte_carlo_trace(path):
+    """
+    Reads a trace file written by write_monte_carlo_trace
+    :param path: the path of the trace file
+    :return: dictionary with the run, positions, sizes and profit arrays
+    """
+    with np.load(path) as trace:
+        return {field: trace[field] for field in trace.files}
+
+
 def print_monte_carlo_result(monte_carlo_runs):
     print("Run\t\t\t\t\tItems\t\t\t\t\t\t\t\t\t\t\t\t\t\t\tProfit")
     print("===================================================================================================")
     for monte_carlo_sim in monte_carlo_runs:
         printed = str(monte_carlo_sim.run) + "\t\t"
-        for item in monte_carlo_sim.items:
-            printed += "Item {}: {},".format(str(item.position), str(item.size))
+        for position, size in zip(monte_carlo_sim.positions, monte_carlo_sim.sizes):
+            printed += "Item {}: {},".format(str(position), str(size))
         printed += "\t\t"
         printed += str(monte_carlo_sim.profit)
         printed += "\n"
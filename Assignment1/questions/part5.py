@@ -1,45 +1,170 @@
-from itertools import product
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from io import StringIO
+from multiprocessing import cpu_count, get_context
+from os import listdir, replace, rmdir
 from os.path import join
+from tempfile import mkdtemp
 
 import gurobipy as gb
+import numpy as np
+
+from models.ArtifactWriter import ArtifactWriter
+from models.ItemTable import ItemTable
+from questions import benders, scenario_reduction, solver_backends
+from questions.scenario_data import get_model_data
 
 
 def run_gurobi(problem_instances, properties, output_folder):
     """
     Method used by main.py, generates models for each problem instance.
     Uses properties dictionary to get the capacity and penalty params.
+    With gurobi_workers different from 1 the models are solved in parallel, see run_model_jobs_in_parallel.
+    The model files are written as the model_artifacts properties say, see ArtifactWriter.
     :param problem_instances: the generated problem instances
     :param properties: dictionary with the properties from yaml file
     :param output_folder: the folder to save the models
     :return:
     """
-    capacity = properties["capacity"]
-    penalty = properties["penalty"]
-    cvar_risks = properties["risks"]["cvar"]
-    ev_risk = properties["risks"]["ev"]
-    beta = properties["beta"]
+    workers = properties.get("gurobi_workers", 1)
+    jobs = get_model_jobs(len(problem_instances), properties, workers)
 
     print("Running gurobi for each problem instance")
-    for i, problem_instance in enumerate(problem_instances):
-        item_indx = list(range(len(problem_instance.items)))
-        scenarios, revenues, probabilities = get_model_data(problem_instance.items)
-        if not properties["part5_skip_ev"]:
+    if workers == 1:
+        writer = ArtifactWriter.from_properties(properties)
+        try:
+            for i, risks in jobs:
+                run_model_job(problem_instances[i].item_table, i, risks, properties, output_folder, writer)
+        finally:
+            writer.close()
+    else:
+        run_model_jobs_in_parallel(problem_instances, jobs, properties, output_folder, workers)
+
+
+def get_model_jobs(num_problem_instances, properties, workers=1):
+    """
+    The models of each instance are the EV model, unless part5_skip_ev is set, and a CVaR model for each risk.
+    A job solves models of one instance from the same model data (get_reduced_model_data), built once per job.
+    All the models of an instance are one job when they run sequentially, when they reuse a single model
+    (reuse_risk_model) or when the data is reduced, whose reduction is too costly to repeat for every risk.
+    Otherwise each model is a job, so the models of an instance are solved in parallel as well.
+    :param num_problem_instances: the number of problem instances
+    :param properties: dictionary with the properties from yaml file
+    :param workers: the gurobi_workers property
+    :return: the list of (instance, list of risks) jobs
+    """
+    risks = ([] if properties["part5_skip_ev"] else [properties["risks"]["ev"]]) + list(properties["risks"]["cvar"])
+    if workers == 1 or reuse_risk_model(properties) or properties.get("scenario_reduction", "none") != "none":
+        return [(i, risks) for i in range(num_problem_instances)]
+    return [(i, [risk]) for i in range(num_problem_instances) for risk in risks]
+
+
+def reuse_risk_model(properties):
+    """
+    :param properties: dictionary with the properties from yaml file
+    :return: whether the models of an instance are solved with a single model (see
+    solver_backends.build_gurobi_risk_model), with reuse_models, the gurobi backend and no decomposition
+    """
+    return (properties.get("reuse_models", False) and properties.get("solver_backend", "gurobi") == "gurobi" and
+            properties.get("decomposition", "none") == "none")
+
+
+def run_model_job(items, i, risks, properties, output_folder, writer=None):
+    """
+    Creates and solves the EV (risk 0) or CVaR models of a problem instance
+    :param items: the problem instance items (ItemTable)
+    :param i: problem instance position in the list
+    :param risks: the model risks, with reuse_risk_model and more than one risk the same model is reused for all
+    :param properties: dictionary with the properties from yaml file
+    :param output_folder: the folder to save the models
+    :param writer: the ArtifactWriter of the model files, if None one is created from the properties and closed
+    before returning, so the files of the job are complete
+    :return: the created models
+    """
+    if writer is None:
+        writer = ArtifactWriter.from_properties(properties)
+        try:
+            return run_model_job(items, i, risks, properties, output_folder, writer)
+        finally:
+            writer.close()
+    scenarios, revenues, probabilities = get_reduced_model_data(items, properties)
+    formulation = properties.get("model_formulation", "scenario")
+    risk_model = None
+    if len(risks) > 1 and reuse_risk_model(properties):
+        print("Creating model for problem instance {}, reused for the risks {}".format(i, risks))
+        risk_model = solver_backends.build_gurobi_risk_model(scenarios, revenues, probabilities,
+                                                             properties["capacity"], properties["penalty"], formulation)
+    models = []
+    for risk in risks:
+        if risk == 0:
             print("Executing EV model for instance{}".format(i))
-            create_model_for_problem_instance(scenarios, revenues, probabilities, item_indx, i=i, capacity=capacity,
-                                              penalty=penalty, risk=ev_risk, output_folder=output_folder,
-                                              full_print=properties["print_gurobi_vars"])
-            print("============================================================")
-        for c, cvar_risk in enumerate(cvar_risks):
-            print("Executing CVaR model for instance{} and CVaR risk {}".format(i, cvar_risk))
-            create_model_for_problem_instance(scenarios, revenues, probabilities, item_indx, i=i, capacity=capacity,
-                                              penalty=penalty,
-                                              risk=cvar_risk, output_folder=output_folder, beta=beta,
-                                              full_print=properties["print_gurobi_vars"])
-            print("============================================================")
+        else:
+            print("Executing CVaR model for instance{} and CVaR risk {}".format(i, risk))
+        beta = None if risk == 0 else properties["beta"]
+        if risk_model is not None:
+            print("Optimizing model {}".format(i))
+            model = solver_backends.solve_gurobi_risk_model(risk_model, risk, beta)
+            print("Getting model results")
+            check_model_status(model, i, risk, probabilities, output_folder, properties["print_gurobi_vars"], writer)
+        else:
+            model = create_model_for_problem_instance(scenarios, revenues, probabilities, list(range(len(items))),
+                                                      i=i, capacity=properties["capacity"],
+                                                      penalty=properties["penalty"], risk=risk,
+                                                      output_folder=output_folder, beta=beta,
+                                                      full_print=properties["print_gurobi_vars"],
+                                                      builder=properties.get("model_builder", "expression"),
+                                                      formulation=formulation,
+                                                      backend=properties.get("solver_backend", "gurobi"),
+                                                      decomposition=properties.get("decomposition", "none"),
+                                                      writer=writer)
+        models.append(model)
+        print("============================================================")
+    return models
+
+
+def run_model_jobs_in_parallel(problem_instances, jobs, properties, output_folder, workers=None):
+    """
+    Solves the model jobs in a process pool. The cores are split between the concurrent jobs and the solver
+    threads of each model (Threads parameter of gurobi). Every job logs into a buffer and writes its model files
+    into its own temporary folder. The logs are printed and the files are moved into the output folder in job
+    order, so the log and the output files are the same as with the sequential run, for any number of workers.
+    :param problem_instances: the generated problem instances
+    :param jobs: the (instance, risks) jobs of get_model_jobs
+    :param properties: dictionary with the properties from yaml file
+    :param output_folder: the folder to save the models
+    :param workers: the number of processes, if None all the available cores are used
+    """
+    workers = min(workers or cpu_count(), len(jobs)) or 1
+    threads = max(1, cpu_count() // workers)
+    print("Solving {} model jobs with {} workers and {} solver threads per model".format(len(jobs), workers, threads))
+    arguments = ([problem_instances[i].item_table for i, _ in jobs], [i for i, _ in jobs], [risks for _, risks in jobs],
+                 [properties] * len(jobs), [output_folder] * len(jobs), [threads] * len(jobs))
+    # gurobi environments must not be shared with forked processes, the workers start as new interpreters
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn")) as executor:
+        for log, job_folder in executor.map(run_model_job_in_process, *arguments):
+            print(log, end="")
+            for file_name in sorted(listdir(job_folder)):
+                replace(join(job_folder, file_name), join(output_folder, file_name))
+            rmdir(job_folder)
+
+
+def run_model_job_in_process(items, i, risks, properties, output_folder, threads):
+    """
+    Worker of run_model_jobs_in_parallel, runs run_model_job with the given number of solver threads
+    :return: the log of the job and the temporary folder with its model files
+    """
+    job_folder = mkdtemp(dir=output_folder)
+    log = StringIO()
+    with redirect_stdout(log):
+        # inside the redirect, so that the parameter message of gurobi goes to the log of the job
+        gb.setParam("Threads", threads)
+        run_model_job(items, i, risks, properties, job_folder)
+    return log.getvalue(), job_folder
 
 
 def create_model_for_problem_instance(scenarios, revenues, probabilities, item_indx, i, capacity, penalty, risk,
-                                      output_folder, beta=None, full_print=False):
+                                      output_folder, beta=None, full_print=False, builder="expression",
+                                      formulation="scenario", backend="gurobi", decomposition=None, writer=None):
     """
     Method executed for each problem instance. Generates the scenarios for size combinations (dl, dh)
     for all the items. Creates a model for this instance and iterates the possible scenarios
@@ -54,39 +179,144 @@ def create_model_for_problem_instance(scenarios, revenues, probabilities, item_i
     :param output_folder: the folder to store the model
     :param beta: beta param
     :param full_print: boolean variable for printing all variable values
-    :return: the created model
+    :param builder: expression to build the model scenario by scenario or matrix for build_matrix_model
+    :param formulation: scenario for a selection per scenario or first_stage for build_first_stage_model, which
+    is always built with the matrix API
+    :param backend: gurobi or highs, which solves the model of solver_backends.get_formulation with
+    scipy.optimize.milp and needs no license
+    :param decomposition: None or none to solve the whole model, aggregated or multi_cut to solve the first_stage
+    formulation with benders.solve_benders, whose master problem is solved with the backend; any other
+    formulation raises an exception. Only the .sol file of the solution is written, no .mps file
+    :param writer: the ArtifactWriter of the model files, if None they are all written on this thread
+    :return: the created model, or the solution dictionary of solver_backends.solve_with_highs for highs or of
+    benders.solve_benders
     """
     print("Creating model for problem instance {}".format(i))
+    if decomposition not in (None, "none"):
+        if formulation != "first_stage":
+            raise Exception("The {} decomposition needs the first_stage model_formulation, not {}".format(
+                decomposition, formulation))
+        print("Optimizing model {} with Benders decomposition ({} cuts)".format(i, decomposition))
+        solution = benders.solve_benders(scenarios, revenues, probabilities, capacity, penalty, risk, beta,
+                                         cuts=decomposition, backend=backend)
+        print(solution["message"])
+        print("Getting model results")
+        check_solution_status(solution, {"variables": solution["variables"]}, i, risk, probabilities, output_folder,
+                              full_print, writer)
+        return solution
+    if backend == "highs":
+        formulation_data = solver_backends.get_formulation(scenarios, revenues, probabilities, capacity, penalty, risk,
+                                                           beta, formulation)
+        print("Optimizing model {} with HiGHS".format(i))
+        solution = solver_backends.solve_with_highs(formulation_data)
+        print("Getting model results")
+        check_solution_status(solution, formulation_data, i, risk, probabilities, output_folder, full_print, writer)
+        return solution
+    elif backend != "gurobi":
+        raise Exception("Unknown solver backend {}".format(backend))
+    if formulation == "first_stage":
+        model = build_first_stage_model(scenarios, revenues, probabilities, capacity, penalty, risk, beta)
+    elif formulation != "scenario":
+        raise Exception("Unknown model formulation {}".format(formulation))
+    elif builder == "expression":
+        print("Executing scenarios")
+        model = build_expression_model(scenarios, revenues, probabilities, item_indx, capacity, penalty, risk, beta)
+    elif builder == "matrix":
+        model = build_matrix_model(scenarios, revenues, probabilities, capacity, penalty, risk, beta)
+    else:
+        raise Exception("Unknown model builder {}".format(builder))
+    print("Optimizing model {}".format(i))
+    # optimize the model
+    model.optimize()
+    print("Getting model results")
+    check_model_status(model, i, risk, probabilities, output_folder, full_print, writer)
+    return model
+
+
+def build_expression_model(scenarios, revenues, probabilities, item_indx, capacity, penalty, risk, beta=None):
+    """
+    Builds the EV (risk 0) or CVaR model one scenario at a time with execute_scenario
+    :param scenarios: item scenarios
+    :param revenues: list with the revenues of the items
+    :param probabilities: scenarios' probabilities
+    :param item_indx: list enumerating the number of items
+    :param capacity: property from yaml file
+    :param penalty: property from yaml file
+    :param risk: model risk
+    :param beta: beta param
+    :return: the model, not optimized, with the variable handles of solver_backends.get_handles in model._handles
+    """
     model = gb.Model('MILP')
     obj = gb.LinExpr()
-
-    print("Executing scenarios")
     h = None
     sws_vars = []
+    decision_vars = []
+    tu_vars = []
+    # python numbers, numpy scalars are not combined with gurobi variables in all gurobipy versions
+    scenarios = np.asarray(scenarios).tolist()
+    probabilities = np.asarray(probabilities).tolist()
     if risk != 0:
         h = model.addVar(vtype=gb.GRB.CONTINUOUS, name="eta", lb=0)
     for j, scenario in enumerate(scenarios):
-        sw = execute_scenario(model=model, obj=obj, scenario=scenario, j=j, h=h, item_indx=item_indx,
-                              capacity=capacity, penalty=penalty, risk=risk, beta=beta, probabilities=probabilities,
-                              revenues=revenues)
+        scenario_vars, tu, sw = execute_scenario(model=model, obj=obj, scenario=scenario, j=j, h=h,
+                                                 item_indx=item_indx, capacity=capacity, penalty=penalty, risk=risk,
+                                                 beta=beta, probabilities=probabilities, revenues=revenues)
+        decision_vars.append([scenario_vars[k] for k in item_indx])
+        tu_vars.append(tu)
         sws_vars.append(sw)
     if risk != 0:
         obj += beta * (
                 h - ((1 / (1 - risk)) * sum(probabilities[j] * sws_vars[j] for j in range(len(probabilities)))))
     # set the objective function to the model
-    print("Setting total objective function to model {}".format(i))
     model.setObjective(obj, gb.GRB.MAXIMIZE)
-    print("Updating model {}".format(i))
     # update the model
     model.update()
-    print("Optimizing model {}".format(i))
-    # optimize the model
-    model.optimize()
-    print("Getting model results")
-    check_model_status(model, i, risk, probabilities, output_folder, full_print)
+    model._handles = {"decision": gb.MVar.fromlist(decision_vars), "tu": gb.MVar.fromlist(tu_vars),
+                      "sw": gb.MVar.fromlist(sws_vars) if risk != 0 else None,
+                      "eta": gb.MVar.fromlist([h]) if risk != 0 else None}
     return model
 
 
+def build_matrix_model(scenarios, revenues, probabilities, capacity, penalty, risk, beta=None):
+    """
+    Builds the same model as build_expression_model, with the same variable and constraint names, but all at once
+    from the scenario matrix and the probability vector with the matrix-variable and matrix-constraint API of
+    gurobipy, from the formulation data of solver_backends.get_formulation. The decision variables are an
+    (scenarios x items) matrix variable and the per-scenario constraints are sparse matrix constraints whose rows
+    hold the sizes (capacity) or the revenues (eta) of one scenario.
+    :param scenarios: the (scenarios x items) size matrix
+    :param revenues: the revenue of each item
+    :param probabilities: the probability vector of the scenarios
+    :param capacity: property from yaml file
+    :param penalty: property from yaml file
+    :param risk: model risk, 0 for the EV model
+    :param beta: beta param of the CVaR model
+    :return: the model, not optimized, with the variable handles of solver_backends.get_handles in model._handles
+    """
+    formulation = solver_backends.get_formulation(scenarios, revenues, probabilities, capacity, penalty, risk, beta)
+    return solver_backends.build_gurobi_model(formulation)[0]
+
+
+def build_first_stage_model(scenarios, revenues, probabilities, capacity, penalty, risk, beta=None):
+    """
+    Builds the first-stage formulation of the EV (risk 0) or CVaR model: the items are selected once, before
+    the sizes are revealed, so a single binary decision vector is shared by all the scenarios and only the
+    overflow tu and the CVaR shortfall sw are per-scenario variables. The model has n binaries instead of
+    n * scenarios. The shortfall of scenario j is sw_j >= eta - (revenues_j * x - penalty * tu_j).
+    :param scenarios: the (scenarios x items) size matrix
+    :param revenues: the revenue of each item
+    :param probabilities: the probability vector of the scenarios
+    :param capacity: property from yaml file
+    :param penalty: property from yaml file
+    :param risk: model risk, 0 for the EV model
+    :param beta: beta param of the CVaR model
+    :return: the model, not optimized, with the variable handles of solver_backends.get_handles in model._handles
+    """
+    formulation = solver_backends.get_formulation(scenarios, revenues, probabilities, capacity, penalty, risk, beta,
+                                                  formulation="first_stage")
+    return solver_backends.build_gurobi_model(formulation)[0]
+
+
 def execute_scenario(model, obj, scenario, j, h, item_indx, capacity, penalty, risk, beta, probabilities, revenues):
     """
     Method executed for each scenario. Calculates for each item its revenue i.e. size[i] * revenue[i]
@@ -104,7 +334,7 @@ def execute_scenario(model, obj, scenario, j, h, item_indx, capacity, penalty, r
     :param beta: beta parm
     :param probabilities: the calculated probabilities of all the scenarios
     :param revenues: the revenue of each item stored in a list
-    :return:
+    :return: the decision variables, the tu variable and the sw variable (None for the EV model) of the scenario
     """
     total_revenues = get_total_revenues(scenario, revenues)
     # create model variables for scenario j
@@ -116,8 +346,8 @@ def execute_scenario(model, obj, scenario, j, h, item_indx, capacity, penalty, r
         # add constraints
         model.addConstr((tu >= sum(scenario[k] * decision_vars[k] for k in item_indx) - capacity),
                         name="items_capacity{}".format(j))
-        model.addConstr(lhs=tu, sense=gb.GRB.GREATER_EQUAL, rhs=0, name="tu_positive{}".format(j))
-        return None
+        model.addConstr(tu >= 0, name="tu_positive{}".format(j))
+        return decision_vars, tu, None
     else:
 
         sw = model.addVar(vtype=gb.GRB.CONTINUOUS, name="sw{}".format(j), lb=0)
@@ -126,36 +356,30 @@ def execute_scenario(model, obj, scenario, j, h, item_indx, capacity, penalty, r
         # add constraints
         model.addConstr((tu >= sum(scenario[k] * decision_vars[k] for k in item_indx) - capacity),
                         name="items_capacity{}".format(j))
-        model.addConstr(lhs=tu, sense=gb.GRB.GREATER_EQUAL, rhs=0, name="tu_positive{}".format(j))
-        model.addConstr(lhs=sw, sense=gb.GRB.GREATER_EQUAL, rhs=0, name="sw_positive{}".format(j))
+        model.addConstr(tu >= 0, name="tu_positive{}".format(j))
+        model.addConstr(sw >= 0, name="sw_positive{}".format(j))
         model.addConstr((sw >= h - sum(total_revenues[k] * decision_vars[k] - (tu * penalty) for k in item_indx)),
                         name="eta_constr{}".format(j))
-        return sw
-
-
-def get_model_data(items):
-    """
-    Based on the combinations for dl and dh, all sizes are created
-    in the list new_scenarios. The function generates the combinations
-    for sizes, the possibility of each scenario and a list of the revenue
-    of each item of the problem instance
-    :param items: the problem instance items
-    :return: four lists with the size combinations, the revenues and the probabilities
-    """
-    new_scenarios = []
-    scenarios = list(product(['dl', 'dh'], repeat=len(items)))
-    revenues = [item.r for item in items]
-    probabilities = []
-    for i, scenario in enumerate(scenarios):
-        new_scenario = []
-        scenario_prob = 1
-        for j, item in enumerate(items):
-            new_scenario.append(item.dl if scenario[j] == 'dl' else item.dh)
-            prob = item.pi if scenario[j] == 'dh' else (1 - item.pi)
-            scenario_prob *= prob
-        new_scenarios.append(new_scenario)
-        probabilities.append(scenario_prob)
-    return new_scenarios, revenues, probabilities
+        return decision_vars, tu, sw
+
+
+def get_reduced_model_data(items, properties):
+    """
+    get_model_data with the scenario reduction of the properties (scenario_reduction, scenario_reduction_target and
+    scenario_reduction_tolerance), see scenario_reduction.reduce_instance_scenarios
+    :param items: the problem instance items (list of Item objects or ItemTable)
+    :param properties: dictionary with the properties from yaml file
+    :return: the (scenarios x items) size matrix, the list of the revenues and the probability vector
+    """
+    method = properties.get("scenario_reduction")
+    if not method or method == "none":
+        return get_model_data(items)
+    table = ItemTable.from_items(items)
+    scenarios, probabilities, distance = scenario_reduction.reduce_instance_scenarios(
+        table, method, target=properties.get("scenario_reduction_target"),
+        tolerance=properties.get("scenario_reduction_tolerance"), seed=properties.get("seed") or 0)
+    print("Reduced {} scenarios to {} with probability distance {}".format(2 ** len(table), len(scenarios), distance))
+    return scenarios, table.r.tolist(), probabilities
 
 
 def get_total_revenues(sizes, revenues):
@@ -172,7 +396,7 @@ def get_total_revenues(sizes, revenues):
     return total_revenues
 
 
-def check_model_status(model, problem_instance, risk, probabilities, output_folder, full_print=False):
+def check_model_status(model, problem_instance, risk, probabilities, output_folder, full_print=False, writer=None):
     """
     Checks the result of the model
     :param model: the generated model
@@ -181,23 +405,24 @@ def check_model_status(model, problem_instance, risk, probabilities, output_fold
     :param probabilities: scenarios' probabilities
     :param output_folder: folder to store the model
     :param full_print: boolean variable for printing all variable values
+    :param writer: the ArtifactWriter of the model files, if None they are all written on this thread
     :return:
     """
     status = model.status
     if status == gb.GRB.Status.OPTIMAL:
         optimal_model(model=model, problem_instance=problem_instance, risk=risk, probabilities=probabilities,
-                      output_folder=output_folder, full_print=full_print)
+                      output_folder=output_folder, full_print=full_print, writer=writer)
     elif status == gb.GRB.Status.INFEASIBLE:
         infeasible_model(model=model, problem_instance=problem_instance, risk=risk, output_folder=output_folder)
     elif status == gb.GRB.Status.INF_OR_UNBD:
         inf_or_unb_model(model=model, problem_instance=problem_instance, risk=risk, probabilities=probabilities,
-                         output_folder=output_folder, full_print=full_print)
+                         output_folder=output_folder, full_print=full_print, writer=writer)
     elif status == gb.GRB.Status.UNBOUNDED:
         unbounded_model(model=model, problem_instance=problem_instance, risk=risk, probabilities=probabilities,
-                        output_folder=output_folder, full_print=full_print)
+                        output_folder=output_folder, full_print=full_print, writer=writer)
 
 
-def optimal_model(model, problem_instance, risk, probabilities, output_folder, full_print=False):
+def optimal_model(model, problem_instance, risk, probabilities, output_folder, full_print=False, writer=None):
     """
      Print results for optimal model - Solution found!
     :param model: model for a specific problem instance
@@ -206,32 +431,113 @@ def optimal_model(model, problem_instance, risk, probabilities, output_folder, f
     :param probabilities: scenarios' probabilities
     :param output_folder: the folder to store the model
     :param full_print: boolean variable for printing all variable values
+    :param writer: the ArtifactWriter of the model files, if None they are all written on this thread
     """
     model_type = "EV" if risk == 0 else "CVaR"
     print("Showing variables and objective function values for problem instance {}".format(problem_instance))
+    # the EV solves of a reused model (solver_backends.build_gurobi_risk_model) leave out its unused CVaR part
+    removed = solver_backends.get_cvar_indices(model) if risk == 0 else None
+    variable_values = get_variable_values(model)
+    if removed is not None:
+        removed_variables = set(removed[0])
+        variable_values = [value for k, value in enumerate(variable_values) if k not in removed_variables]
     if full_print:
-        for v in model.getVars():
-            print('%s %g' % (v.varName, v.x))
+        for name, value in variable_values:
+            print('%s %g' % (name, value))
     obj = model.getObjective()
     print('Profit: %g' % obj.getValue())
+    writer = ArtifactWriter(background=False) if writer is None else writer
+    name = "model{}{}".format(model_type, problem_instance)
     # mps extension for writing the model itself
-    model.write(join(output_folder, "model{}{}.mps".format(model_type, problem_instance)))
-    # sol extension to write current solution
-    model.write(join(output_folder, "model{}{}.sol".format(model_type, problem_instance)))
+    writer.write_model(model, output_folder, name, removed)
+    # sol extension to write current solution, formatted here since the model can change before it is written
+    writer.write_solution(output_folder, name, solver_backends.format_solution(
+        model.ModelName, model.ObjVal, *zip(*variable_values)))
+    if model_type == "CVaR":
+        values = get_solution_values(model)
+        print("Eta value is {}".format(values["eta"]))
+        exp_sw = values["eta"] - ((1 / (1 - risk)) * (np.asarray(probabilities) @ values["sw"]))
+        print("Expected sw is {}".format(exp_sw))
+    print("============================================================")
+
+
+def check_solution_status(solution, formulation, problem_instance, risk, probabilities, output_folder,
+                          full_print=False, writer=None):
+    """
+    check_model_status and optimal_model for the solutions of solver_backends.solve_with_highs and
+    benders.solve_benders. Only the solution is written, as model{type}{instance}.sol, also in the full
+    model_artifacts mode, since there is no gurobi model of the whole problem
+    :param solution: the solution dictionary
+    :param formulation: the formulation data of the solved model
+    :param problem_instance: the respective problem instance
+    :param risk: the model's risk
+    :param probabilities: scenarios' probabilities
+    :param output_folder: folder to store the solution
+    :param full_print: boolean variable for printing all variable values
+    :param writer: the ArtifactWriter of the solution file, if None it is written on this thread
+    """
+    if solution["status"] != "optimal":
+        print("Optimization was stopped with status {}: {}".format(solution["status"], solution["message"]))
+        return
+    model_type = "EV" if risk == 0 else "CVaR"
+    print("Showing variables and objective function values for problem instance {}".format(problem_instance))
+    if full_print:
+        for name, value in get_variable_values(solution, formulation):
+            print('%s %g' % (name, value))
+    print('Profit: %g' % solution["objective"])
+    writer = ArtifactWriter(background=False) if writer is None else writer
+    writer.write_solution(output_folder, "model{}{}".format(model_type, problem_instance),
+                          solver_backends.get_solution_text(formulation, solution))
     if model_type == "CVaR":
-        sum_sw_p = 0
-        for p, probability in enumerate(probabilities):
-            for v in model.getVars():
-                if "sw{}".format(p) in v.varName:
-                    sum_sw_p += probability * v.x
-        for v in model.getVars():
-            if "eta" in v.varName:
-                print("Eta value is {}".format(v.x))
-                exp_sw = v.x - ((1 / (1 - risk)) * sum_sw_p)
-                print("Expected sw is {}".format(exp_sw))
+        values = get_solution_values(solution)
+        print("Eta value is {}".format(values["eta"]))
+        exp_sw = values["eta"] - ((1 / (1 - risk)) * (np.asarray(probabilities) @ values["sw"]))
+        print("Expected sw is {}".format(exp_sw))
     print("============================================================")
 
 
+def get_objective_value(model):
+    """
+    :param model: an optimized gurobi model or a solution dictionary of solver_backends.solve_with_highs
+    :return: the objective value
+    """
+    if isinstance(model, dict):
+        return model["objective"]
+    return model.getObjective().getValue()
+
+
+def get_solution_values(model):
+    """
+    The solution values of the variable handles, in one bulk query per handle
+    :param model: an optimized model with variable handles (model._handles) or a solution dictionary of
+    solver_backends.solve_with_highs
+    :return: dictionary with the decision values ((scenarios x items), or (items) for the first-stage formulation),
+    the tu and sw values per scenario and the eta value, sw and eta are None for the EV model
+    """
+    if isinstance(model, dict):
+        values = solver_backends.get_handles(model["values"])
+    else:
+        values = {name: None if handle is None else handle.X for name, handle in model._handles.items()}
+    if values["eta"] is not None:
+        values["eta"] = float(values["eta"][0])
+    return values
+
+
+def get_variable_values(model, formulation=None):
+    """
+    :param model: an optimized gurobi model or a solution dictionary of solver_backends.solve_with_highs
+    :param formulation: the formulation data of the solution dictionary, rebuilt from its shapes if None
+    :return: list of (variable name, value) pairs
+    """
+    if not isinstance(model, dict):
+        return list(zip(model.getAttr("VarName", model.getVars()), model.getAttr("X", model.getVars())))
+    variables = formulation["variables"] if formulation is not None else \
+        [{"name": name, "shape": values.shape} for name, values in model["values"].items()]
+    return [(name, value) for variable in variables
+            for name, value in zip(solver_backends.variable_names(variable).ravel().tolist(),
+                                   model["values"][variable["name"]].ravel().tolist())]
+
+
 def infeasible_model(model, problem_instance, risk, output_folder):
     """
     Compute IIS if model is infeasible. Print the constraints and
@@ -251,7 +557,7 @@ def infeasible_model(model, problem_instance, risk, output_folder):
             print('%s' % c.constrName)
 
 
-def inf_or_unb_model(model, problem_instance, risk, probabilities, output_folder, full_print=False):
+def inf_or_unb_model(model, problem_instance, risk, probabilities, output_folder, full_print=False, writer=None):
     """
     Model is either infeasible or unbounded. Set DualReductions parameter
     to zero in order to get a more precise response and re-optimize. Finally,
@@ -262,13 +568,14 @@ def inf_or_unb_model(model, problem_instance, risk, probabilities, output_folder
     :param probabilities: scenarios' probabilities
     :param output_folder: the folder to store the model
     :param full_print: boolean variable for printing all variable values
+    :param writer: the ArtifactWriter of the model files
     """
     model.setParam("DualReductions", 0)
     model.optimize()
-    check_model_status(model, problem_instance, risk, probabilities, output_folder, full_print)
+    check_model_status(model, problem_instance, risk, probabilities, output_folder, full_print, writer)
 
 
-def unbounded_model(model, problem_instance, risk, probabilities, output_folder, full_print=False):
+def unbounded_model(model, problem_instance, risk, probabilities, output_folder, full_print=False, writer=None):
     """
     Model is unbounded. Set objective function to zero and re-optimize.
     Check the status of the model again to see if it is feasible
@@ -278,7 +585,8 @@ def unbounded_model(model, problem_instance, risk, probabilities, output_folder,
     :param probabilities: scenarios' probabilities
     :param output_folder: folder to store the model
     :param full_print: boolean variable for printing all variable values
+    :param writer: the ArtifactWriter of the model files
     """
     model.setObjective(0, gb.GRB.MAXIMIZE)
     model.optimize()
-    check_model_status(model, problem_instance, risk, probabilities, output_folder, full_print)
+    check_model_status(model, problem_instance, risk, probabilities, output_folder, full_print, writer)
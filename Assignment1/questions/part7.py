@@ -1,7 +1,9 @@
 from math import sqrt
 
+import numpy as np
 from scipy import stats
 
+from models.ArtifactWriter import ArtifactWriter
 from questions import part5
 
 
@@ -15,44 +17,67 @@ def run_sample_average_approximation(instance, properties, output_folder, bonus=
     :param output_folder: the output folder to store results
     :param bonus: boolean var determining if we run the bonus question
     """
+    writer = ArtifactWriter.from_properties(properties)
+    try:
+        data_runs = run_saa_replications(instance, properties, output_folder, writer, bonus)
+    finally:
+        writer.close()
+    get_ev_model_bounds_and_gap(data_runs, properties["saa_runs"])
+    if not bonus:
+        get_cvar_model_bounds_and_gap(data_runs, properties["saa_runs"])
+
+
+def run_saa_replications(instance, properties, output_folder, writer, bonus=False):
+    """
+    Solves the EV model, and the CVaR model if not bonus, of every SAA replication
+    :param instance: the first problem instance
+    :param properties: dictionary containing properties from yaml file
+    :param output_folder: the output folder to store results
+    :param writer: the ArtifactWriter of the model files
+    :param bonus: boolean var determining if we run the bonus question
+    :return: the list with the dictionary data for each run
+    """
     saa_runs = properties["saa_runs"]
     data_runs = []
     for run in range(saa_runs):
         run_dict = {}
         print("Running sample average approximation. Run {}".format(run))
         print("============================================")
-        items = instance.items
+        items = instance.item_table
         item_indx = list(range(len(items)))
         saa_bernoulli_runs = properties["saa_bernoulli_runs"]
         # total_items contain 200 lists (the scenarios) with 10 items each
         total_items = []
         for i in range(saa_bernoulli_runs):
-            new_items = []
-            for item in items:
-                # generate item sizes using uniform distribution
-                unif = stats.uniform(0, 1).rvs(1)
-                if not bonus:
-                    item.size = item.dh if unif[0] < item.pi else item.dl
-                else:
-                    size1 = item.dh if unif[0] < item.pi else item.dl
-                    size2 = item.dh if (1 - unif[0]) < item.pi else item.dl
-                    mean_size = (size1 + size2) / 2
-                    item.size = mean_size
-                new_items.append(item.size)
-            total_items.append(new_items)
-        revenues = [item.r for item in items]
+            # generate item sizes using uniform distribution
+            unif = stats.uniform(0, 1).rvs(len(items))
+            if not bonus:
+                sizes = np.where(unif < items.pi, items.dh, items.dl)
+            else:
+                size1 = np.where(unif < items.pi, items.dh, items.dl)
+                size2 = np.where((1 - unif) < items.pi, items.dh, items.dl)
+                sizes = (size1 + size2) / 2
+            total_items.append(sizes.tolist())
+        revenues = items.r.tolist()
         probabilities = [1 / saa_bernoulli_runs] * saa_bernoulli_runs
         capacity = properties["capacity"]
         penalty = properties["penalty"]
         cvar_risk = properties["risks"]["cvar"][0]
         ev_risk = properties["risks"]["ev"]
         beta = properties["beta"]
+        builder = properties.get("model_builder", "expression")
+        formulation = properties.get("model_formulation", "scenario")
+        backend = properties.get("solver_backend", "gurobi")
+        decomposition = properties.get("decomposition", "none")
 
         # run EV model
         print("Executing EV model for instance")
         ev_model = part5.create_model_for_problem_instance(total_items, revenues, probabilities, item_indx, i=0,
                                                            capacity=capacity,
-                                                           penalty=penalty, risk=ev_risk, output_folder=output_folder)
+                                                           penalty=penalty, risk=ev_risk, output_folder=output_folder,
+                                                           builder=builder, formulation=formulation,
+                                                           backend=backend, decomposition=decomposition,
+                                                           writer=writer)
         ev_profits = calc_ev_profits(ev_model, total_items, revenues, item_indx, penalty)
         print("EVPROFS", ev_profits)
         ev_variance, ev_profits_mean = sample_variance(ev_profits, saa_bernoulli_runs)
@@ -61,7 +86,7 @@ def run_sample_average_approximation(instance, properties, output_folder, bonus=
         run_dict["ev_upper_bound"] = ev_upper_bound
         run_dict["ev_model"] = ev_model
         run_dict["ev_profits"] = ev_profits
-        run_dict["ev_total_profit"] = ev_model.getObjective().getValue()
+        run_dict["ev_total_profit"] = part5.get_objective_value(ev_model)
 
         # run CVaR model for part 7
         if not bonus:
@@ -69,21 +94,22 @@ def run_sample_average_approximation(instance, properties, output_folder, bonus=
             cvar_model = part5.create_model_for_problem_instance(total_items, revenues, probabilities, item_indx, i=0,
                                                                  capacity=capacity,
                                                                  penalty=penalty,
-                                                                 risk=cvar_risk, output_folder=output_folder, beta=beta)
+                                                                 risk=cvar_risk, output_folder=output_folder, beta=beta,
+                                                                 builder=builder, formulation=formulation,
+                                                                 backend=backend,
+                                                                 decomposition=decomposition, writer=writer)
             cvar_profits = calc_cvar_profits(cvar_model, total_items, revenues, item_indx, penalty, beta,
                                              cvar_risk)
             print("CVARPROFS", cvar_profits)
             run_dict["cvar_model"] = cvar_model
             run_dict["cvar_profits"] = cvar_profits
-            run_dict["cvar_total_profit"] = cvar_model.getObjective().getValue()
+            run_dict["cvar_total_profit"] = part5.get_objective_value(cvar_model)
             cvar_variance, cvar_profit_mean = sample_variance(cvar_profits, saa_bernoulli_runs)
             print("CVaR variance of scenario profits for run {} is {}".format(run, cvar_variance))
             cvar_upper_bound = cvar_profit_mean + (1.64 * sqrt(cvar_variance))
             run_dict["cvar_upper_bound"] = cvar_upper_bound
         data_runs.append(run_dict)
-    get_ev_model_bounds_and_gap(data_runs, saa_runs)
-    if not bonus:
-        get_cvar_model_bounds_and_gap(data_runs, saa_runs)
+    return data_runs
 
 
 def get_cvar_model_bounds_and_gap(data_runs, saa_runs):
@@ -131,33 +157,21 @@ def calc_ev_profits(model, total_items, revenues, item_indx, penalty):
     """
     Based on the EV model's objective function and the variable values, we calculate
     the profit of each scenario in EV model
-    :param model: the created model
+    :param model: the created model (or solution dictionary of the highs backend or the decomposition)
     :param total_items: the list of the scenarios (sizes)
     :param revenues: the list of the revenue of each item
     :param item_indx: a list with numbers 0-9
     :param penalty: the penalty to be assigned when capacity is exceeded
     :return: a list with the profit of each scenario
     """
-    profits = []
-    for i, scenario in enumerate(total_items):
-        total_revenues = part5.get_total_revenues(scenario, revenues)
-        decision_vars = []
-        tu = None
-        for v in model.getVars():
-            if "penalty_decision{}".format(i) in v.varName:
-                tu = v.x
-            elif "decision_var{}".format(i) in v.varName:
-                decision_vars.append(v.x)
-        scenario_profit = sum(total_revenues[j] * decision_vars[j] for j in item_indx) - tu * penalty
-        profits.append(scenario_profit)
-    return profits
+    return get_scenario_profits(part5.get_solution_values(model), total_items, revenues, item_indx, penalty).tolist()
 
 
 def calc_cvar_profits(model, total_items, revenues, item_indx, penalty, beta, risk):
     """
         Based on the CVaR model's objective function and the variable values, we calculate
         the profit of each scenario in CVaR model
-        :param model: the created model
+        :param model: the created model (or solution dictionary of the highs backend or the decomposition)
         :param total_items: the list of the scenarios (sizes)
         :param revenues: the list of the revenue of each item
         :param item_indx: a list with numbers 0-9
@@ -166,27 +180,24 @@ def calc_cvar_profits(model, total_items, revenues, item_indx, penalty, beta, ri
         :param risk: the model's risk
         :return: a list with the profit of each scenario
         """
-    profits = []
-    for i, scenario in enumerate(total_items):
-        total_revenues = part5.get_total_revenues(scenario, revenues)
-        decision_vars = []
-        tu = None
-        h = None
-        sw = None
-        for v in model.getVars():
-            if "penalty_decision{}".format(i) in v.varName:
-                tu = v.x
-            elif "decision_var{}".format(i) in v.varName:
-                decision_vars.append(v.x)
-            elif "eta" in v.varName:
-                h = v.x
-            elif "sw{}".format(i) in v.varName:
-                sw = v.x
-        scenario_profit = (1 - beta) * (
-                    sum(total_revenues[j] * decision_vars[j] for j in item_indx) - tu * penalty) + beta * (
-                                      h - ((1 / (1 - risk)) * sw))
-        profits.append(scenario_profit)
-    return profits
+    values = part5.get_solution_values(model)
+    profits = get_scenario_profits(values, total_items, revenues, item_indx, penalty)
+    return ((1 - beta) * profits + beta * (values["eta"] - ((1 / (1 - risk)) * values["sw"]))).tolist()
+
+
+def get_scenario_profits(values, total_items, revenues, item_indx, penalty):
+    """
+    :param values: the solution values of part5.get_solution_values
+    :param total_items: the list of the scenarios (sizes)
+    :param revenues: the list of the revenue of each item
+    :param item_indx: a list with numbers 0-9
+    :param penalty: the penalty to be assigned when capacity is exceeded
+    :return: array with the revenue of the selected items minus the penalty of each scenario, the decision vector
+    of first-stage models is shared by all the scenarios
+    """
+    total_revenues = np.asarray(total_items)[:, item_indx] * np.asarray(revenues)[item_indx]
+    decisions = values["decision"][..., item_indx]
+    return (total_revenues * decisions).sum(axis=1) - (values["tu"] * penalty)
 
 
 def sample_variance(values, runs):
@@ -0,0 +1,48 @@
+import numpy as np
+
+from models.ItemTable import ItemTable
+
+
+def get_model_data(items):
+    """
+    Based on the combinations for dl and dh, all sizes are created
+    in the scenario matrix. The function generates the combinations
+    for sizes, the possibility of each scenario and a list of the revenue
+    of each item of the problem instance. The scenarios are in the order of
+    itertools.product(['dl', 'dh'], repeat=len(items)), i.e. item j is dh in scenario s
+    if bit (n - 1 - j) of s is set.
+    :param items: the problem instance items (list of Item objects or ItemTable)
+    :return: the (scenarios x items) size matrix, the list of the revenues and the probability vector
+    """
+    table = ItemTable.from_items(items)
+    scenarios, probabilities = get_scenario_chunk(table, 0, 2 ** len(table))
+    return scenarios, table.r.tolist(), probabilities
+
+
+def iterate_scenarios(items, chunk_size=2 ** 16):
+    """
+    Lazy version of get_model_data, yields the scenarios in chunks, so that large scenario sets can be
+    streamed into model construction or evaluation without keeping all of them in memory
+    :param items: the problem instance items (list of Item objects or ItemTable)
+    :param chunk_size: the number of scenarios per chunk
+    :return: generator of (first scenario index, size matrix, probability vector) tuples
+    """
+    table = ItemTable.from_items(items)
+    for start in range(0, 2 ** len(table), chunk_size):
+        scenarios, probabilities = get_scenario_chunk(table, start, min(start + chunk_size, 2 ** len(table)))
+        yield start, scenarios, probabilities
+
+
+def get_scenario_chunk(table, start, end):
+    """
+    Builds the scenarios start..end-1 from their bit patterns with numpy broadcasting
+    :param table: ItemTable with the items
+    :param start: the first scenario index
+    :param end: the scenario index after the last one
+    :return: the (scenarios x items) size matrix and the probability vector
+    """
+    shifts = np.arange(len(table) - 1, -1, -1)
+    high = ((np.arange(start, end)[:, None] >> shifts) & 1).astype(bool)
+    scenarios = np.where(high, table.dh, table.dl)
+    probabilities = np.prod(np.where(high, table.pi, 1 - table.pi), axis=1)
+    return scenarios, probabilities
@@ -0,0 +1,194 @@
+import numpy as np
+
+from models.ItemTable import ItemTable
+from questions.scenario_data import get_model_data, iterate_scenarios
+
+# the largest number of scenarios of the forward selection, whose distance matrix has scenarios^2 entries; above it
+# the auto method clusters the scenarios
+forward_max_scenarios = 4096
+# maximum number of entries of the temporary distance arrays
+distance_block_size = 2 ** 22
+
+
+def reduce_instance_scenarios(items, method="auto", target=None, tolerance=None, seed=0):
+    """
+    Scenario reduction for the part5 models: selects a small subset of the 2^n dl/dh scenarios of an instance and
+    gives every removed scenario's probability to the kept scenario that represents it. The error of the reduced
+    distribution is measured with the probability (Kantorovich) distance: the expected L1 distance between the
+    size vector of a scenario and the size vector of its representative.
+    :param items: the problem instance items (list of Item objects or ItemTable)
+    :param method: forward for fast_forward_selection (up to forward_max_scenarios scenarios), kmeans for
+    cluster_scenarios or auto for forward up to forward_max_scenarios scenarios and kmeans above
+    :param target: the number of kept scenarios, None to stop at the tolerance
+    :param tolerance: the largest probability distance, None to stop at the target
+    :param seed: the seed of the kmeans initialization
+    :return: the (kept scenarios x items) size matrix, their probability vector and the probability distance
+    """
+    table = ItemTable.from_items(items)
+    if method == "auto":
+        method = "forward" if 2 ** len(table) <= forward_max_scenarios else "kmeans"
+    if method == "forward":
+        check_forward_size(2 ** len(table))
+        scenarios, _, probabilities = get_model_data(table)
+        return fast_forward_selection(scenarios, probabilities, target, tolerance)
+    if method == "kmeans":
+        return cluster_scenarios(table, target, tolerance, seed=seed)
+    raise Exception("Unknown scenario reduction method {}".format(method))
+
+
+def fast_forward_selection(scenarios, probabilities, target=None, tolerance=None):
+    """
+    Fast forward selection of Heitsch and Roemisch. Starting from no scenarios, it adds the scenario that gives the
+    smallest probability distance to the kept set, until target scenarios are kept or the distance is at most the
+    tolerance. Every removed scenario is represented by its nearest kept scenario. The distance matrix of all the
+    scenario pairs limits it to forward_max_scenarios scenarios.
+    :param scenarios: the (scenarios x items) size matrix
+    :param probabilities: the probability vector of the scenarios
+    :param target: the number of kept scenarios, None to stop at the tolerance
+    :param tolerance: the largest probability distance, None to stop at the target
+    :return: the kept scenarios in their original order, their probability vector and the probability distance
+    """
+    if target is None and tolerance is None:
+        raise Exception("Scenario reduction needs a target number of scenarios or a tolerance")
+    scenarios = np.asarray(scenarios)
+    probabilities = np.asarray(probabilities, dtype=np.float64)
+    num_scenarios = len(scenarios)
+    check_forward_size(num_scenarios)
+    target = num_scenarios if target is None else min(target, num_scenarios)
+    distances = l1_distances(scenarios, scenarios)
+    # distance of every scenario to its nearest kept scenario
+    nearest = np.full(num_scenarios, np.inf, dtype=np.float32)
+    remaining = np.ones(num_scenarios, dtype=bool)
+    selected = []
+    distance = np.inf
+    while len(selected) < target and (tolerance is None or distance > tolerance):
+        candidates = np.flatnonzero(remaining)
+        candidate_distances = probabilities[candidates] @ np.minimum(nearest[candidates, None],
+                                                                     distances[np.ix_(candidates, candidates)])
+        best = int(np.argmin(candidate_distances))
+        distance = float(candidate_distances[best])
+        selected.append(candidates[best])
+        remaining[candidates[best]] = False
+        nearest = np.minimum(nearest, distances[:, candidates[best]])
+    selected = np.sort(selected)
+    representatives = selected[np.argmin(distances[:, selected], axis=1)]
+    reduced_probabilities = np.bincount(np.searchsorted(selected, representatives), weights=probabilities,
+                                        minlength=len(selected))
+    return scenarios[selected], reduced_probabilities, max(distance, 0.0)
+
+
+def check_forward_size(num_scenarios):
+    """
+    Raises an exception above forward_max_scenarios scenarios, before the forward selection allocates its distance
+    matrix
+    :param num_scenarios: the number of scenarios
+    """
+    if num_scenarios > forward_max_scenarios:
+        raise Exception("The forward scenario reduction supports up to {} scenarios, not {}: use kmeans or auto".format(
+            forward_max_scenarios, num_scenarios))
+
+
+def cluster_scenarios(items, target=None, tolerance=None, iterations=50, sample_size=None, seed=0):
+    """
+    Clustering of the size vectors with k-means, for instances whose scenarios are too many for the forward
+    selection. The k-means runs on scenarios sampled from the size distribution and every cluster is represented by
+    its sampled member nearest to the centroid. Then all the 2^n scenarios are streamed in chunks with
+    scenario_data.iterate_scenarios and each one gives its probability to its nearest representative (L1 distance),
+    as in fast_forward_selection, so the memory does not depend on 2^n. With a tolerance and no target, the number of
+    clusters is doubled until the probability distance is at most the tolerance.
+    :param items: the problem instance items (list of Item objects or ItemTable)
+    :param target: the number of kept scenarios, None to stop at the tolerance
+    :param tolerance: the largest probability distance, None to stop at the target
+    :param iterations: the maximum number of k-means iterations
+    :param sample_size: the number of sampled scenarios, if None 64 per cluster and at least 2^14
+    :param seed: the seed of the sampling
+    :return: the kept scenarios in their original order, their probability vector and the probability distance
+    """
+    if target is None and tolerance is None:
+        raise Exception("Scenario reduction needs a target number of scenarios or a tolerance")
+    table = ItemTable.from_items(items)
+    num_clusters = 1 if target is None else min(target, 2 ** len(table))
+    rng = np.random.default_rng(seed)
+    while True:
+        high = rng.random((sample_size or max(64 * num_clusters, 2 ** 14), len(table))) < table.pi
+        samples = np.where(high, table.dh, table.dl).astype(np.float64)
+        centroids = samples[rng.choice(len(samples), num_clusters, replace=False)]
+        for _ in range(iterations):
+            labels = nearest_centroids(samples, centroids)
+            counts = np.bincount(labels, minlength=num_clusters)
+            filled = counts > 0
+            new_centroids = centroids.copy()
+            for j in range(len(table)):
+                new_centroids[filled, j] = (np.bincount(labels, weights=samples[:, j], minlength=num_clusters)[filled] /
+                                            counts[filled])
+            converged = np.allclose(new_centroids, centroids)
+            centroids = new_centroids
+            if converged:
+                break
+        labels = nearest_centroids(samples, centroids)
+        member_distances = ((samples - centroids[labels]) ** 2).sum(axis=1)
+        # the sampled member nearest to the centroid of every non-empty cluster
+        order = np.lexsort((member_distances, labels))
+        members = order[np.r_[True, labels[order][1:] != labels[order][:-1]]]
+        indices = np.unique(high[members] @ (2 ** np.arange(len(table) - 1, -1, -1)))
+        scenarios, probabilities, distance = assign_scenarios(table, indices)
+        if target is not None or distance <= tolerance or num_clusters >= 2 ** len(table):
+            return scenarios, probabilities, distance
+        num_clusters = min(2 * num_clusters, 2 ** len(table))
+
+
+def assign_scenarios(table, indices):
+    """
+    Gives the probability of every scenario to its nearest kept scenario. Since every size is dl or dh, the L1
+    distance of two scenarios is the sum of |dh - dl| over the items where their bit patterns differ, which is
+    computed for a whole chunk with two matrix products.
+    :param table: ItemTable with the items
+    :param indices: the sorted indices of the kept scenarios (in the order of scenario_data.get_model_data)
+    :return: the kept scenarios, their probability vector and the probability distance
+    """
+    shifts = np.arange(len(table) - 1, -1, -1)
+    kept_high = ((indices[:, None] >> shifts) & 1).astype(np.float64)
+    widths = np.abs(table.dh.astype(np.float64) - table.dl)
+    probabilities = np.zeros(len(indices))
+    distance = 0.0
+    for start, scenarios, chunk_probabilities in iterate_chunks(table, len(indices)):
+        high = ((np.arange(start, start + len(scenarios))[:, None] >> shifts) & 1).astype(np.float64)
+        distances = ((high * widths) @ (1 - kept_high).T) + (((1 - high) * widths) @ kept_high.T)
+        probabilities += np.bincount(np.argmin(distances, axis=1), weights=chunk_probabilities,
+                                     minlength=len(indices))
+        distance += float(chunk_probabilities @ distances.min(axis=1))
+    scenarios = np.where(kept_high.astype(bool), table.dh, table.dl)
+    return scenarios, probabilities, distance
+
+
+def iterate_chunks(table, num_kept):
+    """
+    scenario_data.iterate_scenarios with chunks whose (chunk x kept scenarios) distance arrays have at most
+    distance_block_size entries
+    """
+    return iterate_scenarios(table, max(1, distance_block_size // num_kept))
+
+
+def nearest_centroids(scenarios, centroids):
+    """
+    :param scenarios: a (scenarios x items) size matrix
+    :param centroids: the (clusters x items) centroids
+    :return: the index of the nearest centroid (squared euclidean distance) of every scenario
+    """
+    scenarios = scenarios.astype(np.float64)
+    distances = (centroids ** 2).sum(axis=1) - (2 * (scenarios @ centroids.T))
+    return np.argmin(distances, axis=1)
+
+
+def l1_distances(scenarios, others):
+    """
+    :param scenarios: a (scenarios x items) size matrix
+    :param others: another (scenarios x items) size matrix
+    :return: the (scenarios x others) matrix of the L1 distances, as float32
+    """
+    distances = np.empty((len(scenarios), len(others)), dtype=np.float32)
+    block = max(1, distance_block_size // max(1, len(others) * scenarios.shape[1]))
+    for start in range(0, len(scenarios), block):
+        distances[start:start + block] = np.abs(scenarios[start:start + block, None, :].astype(np.float32) -
+                                                others[None, :, :]).sum(axis=2)
+    return distances
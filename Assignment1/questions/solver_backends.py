@@ -0,0 +1,315 @@
+import gurobipy as gb
+import numpy as np
+from scipy import optimize, sparse
+
+# status of the scipy.optimize.milp result
+highs_statuses = {0: "optimal", 1: "limit", 2: "infeasible", 3: "unbounded", 4: "other"}
+
+
+def get_formulation(scenarios, revenues, probabilities, capacity, penalty, risk, beta=None, formulation="scenario",
+                    cvar=None):
+    """
+    Solver-independent data of the EV (risk 0) or CVaR model of part5, from which every solver backend builds
+    its model. The variables are blocks of non-negative variables (eta, decision_var, penalty_decision, sw),
+    the constraints are blocks of "sum of coefficient matrix @ variable block >= rhs" rows, one row per
+    scenario, and the objective, which is maximized, has a coefficient vector per variable block. The
+    scenario formulation has a decision vector per scenario (see part5.execute_scenario), the
+    first_stage formulation a single decision vector shared by all the scenarios, whose CVaR shortfall
+    subtracts the scenario penalty once.
+    :param scenarios: the (scenarios x items) size matrix
+    :param revenues: the revenue of each item
+    :param probabilities: the probability vector of the scenarios
+    :param capacity: the capacity of the knapsack
+    :param penalty: the penalty per size unit
+    :param risk: model risk, 0 for the EV model
+    :param beta: beta param of the CVaR model
+    :param formulation: scenario or first_stage
+    :param cvar: whether the CVaR variables and constraints are included, if None only for risk != 0. With risk 0
+    they have no objective coefficients and the model is the EV model
+    :return: dictionary with the variables, constraints and objective of the model, and the data that
+    get_objective needs to change the objective
+    """
+    scenarios = np.asarray(scenarios, dtype=np.float64)
+    probabilities = np.asarray(probabilities, dtype=np.float64)
+    num_scenarios, num_items = scenarios.shape
+    total_revenues = scenarios * np.asarray(revenues, dtype=np.float64)
+    identity = sparse.identity(num_scenarios, format="csr")
+    if formulation == "scenario":
+        decision_shape = (num_scenarios, num_items)
+        capacity_rows, revenue_rows = block_rows(scenarios), block_rows(total_revenues)
+        expected_revenues = (probabilities[:, None] * total_revenues).ravel()
+    elif formulation == "first_stage":
+        decision_shape = (num_items,)
+        capacity_rows, revenue_rows = sparse.csr_matrix(scenarios), sparse.csr_matrix(total_revenues)
+        expected_revenues = probabilities @ total_revenues
+    else:
+        raise Exception("Unknown model formulation {}".format(formulation))
+    variables = [{"name": "decision_var", "shape": decision_shape, "binary": True},
+                 {"name": "penalty_decision", "shape": (num_scenarios,), "binary": False}]
+    constraints = [{"name": "items_capacity", "coefficients": {"penalty_decision": identity,
+                                                               "decision_var": -capacity_rows},
+                    "rhs": np.full(num_scenarios, -float(capacity))}]
+    # the scenario formulation keeps the non-negativity rows of execute_scenario, they are redundant with the bounds
+    if formulation == "scenario":
+        constraints.append({"name": "tu_positive", "coefficients": {"penalty_decision": identity},
+                            "rhs": np.zeros(num_scenarios)})
+    cvar = risk != 0 if cvar is None else cvar
+    if cvar:
+        variables.insert(0, {"name": "eta", "shape": (1,), "binary": False})
+        variables.append({"name": "sw", "shape": (num_scenarios,), "binary": False})
+        if formulation == "scenario":
+            constraints.append({"name": "sw_positive", "coefficients": {"sw": identity},
+                                "rhs": np.zeros(num_scenarios)})
+        # the scenario formulation subtracts tu * penalty once per item, as execute_scenario does
+        tu_penalty = penalty * (num_items if formulation == "scenario" else 1)
+        constraints.append({"name": "eta_constr",
+                            "coefficients": {"sw": identity, "eta": sparse.csr_matrix(-np.ones((num_scenarios, 1))),
+                                             "decision_var": revenue_rows, "penalty_decision": -tu_penalty * identity},
+                            "rhs": np.zeros(num_scenarios)})
+    return {"variables": variables, "constraints": constraints,
+            "objective": get_objective(expected_revenues, probabilities, penalty, risk, beta, cvar),
+            "expected_revenues": expected_revenues, "probabilities": probabilities, "penalty": penalty}
+
+
+def get_objective(expected_revenues, probabilities, penalty, risk, beta, cvar=None):
+    """
+    The objective coefficients of each variable block. The CVaR objective is (1 - beta) times the expected profit
+    plus beta times eta - E[sw] / (1 - risk). The EV objective (risk 0) is the CVaR objective with beta 0.
+    :param expected_revenues: the objective coefficients of the decision variables in the EV model
+    :param probabilities: the probability vector of the scenarios
+    :param penalty: the penalty per size unit
+    :param risk: model risk, 0 for the EV model
+    :param beta: beta param of the CVaR model
+    :param cvar: whether the model has the CVaR variables eta and sw, if None only for risk != 0
+    :return: dictionary with the coefficient vector of each variable block
+    """
+    weight = 0 if risk == 0 else beta
+    objective = {"decision_var": (1 - weight) * expected_revenues,
+                 "penalty_decision": -(1 - weight) * penalty * probabilities}
+    if risk != 0 if cvar is None else cvar:
+        objective["eta"] = np.array([weight], dtype=np.float64)
+        objective["sw"] = -(weight / (1 - risk)) * probabilities
+    return objective
+
+
+def block_rows(matrix):
+    """
+    Sparse (rows x rows * columns) matrix whose row j holds row j of the given matrix at the columns of the
+    decision variables of scenario j
+    :param matrix: a (scenarios x items) matrix
+    :return: scipy csr matrix
+    """
+    num_rows, num_columns = matrix.shape
+    return sparse.csr_matrix((matrix.ravel(), np.arange(num_rows * num_columns),
+                              np.arange(0, (num_rows * num_columns) + 1, num_columns)),
+                             shape=(num_rows, num_rows * num_columns))
+
+
+def variable_names(variable):
+    """
+    The names of a variable block, as in part5.execute_scenario: decision_var{scenario}[item] for the scenario
+    formulation, decision_var[item] for the first-stage one, {name}{scenario} for the per-scenario blocks
+    :param variable: a variable block of the formulation
+    :return: numpy array of names with the shape of the block
+    """
+    if variable["name"] == "eta":
+        return np.array(["eta"])
+    if variable["name"] == "decision_var":
+        items = np.char.add(np.char.add("[", np.arange(variable["shape"][-1]).astype(str)), "]")
+        if len(variable["shape"]) == 1:
+            return np.char.add("decision_var", items)
+        return np.char.add(np.char.add("decision_var", np.arange(variable["shape"][0]).astype(str))[:, None], items)
+    return np.char.add(variable["name"], np.arange(variable["shape"][0]).astype(str))
+
+
+def constraint_names(constraint):
+    return np.char.add(constraint["name"], np.arange(len(constraint["rhs"])).astype(str))
+
+
+def build_gurobi_model(formulation):
+    """
+    Gurobi backend: builds the model of the formulation with the matrix-variable and matrix-constraint API
+    :param formulation: the formulation data of get_formulation
+    :return: the model, not optimized, with the variable handles of get_handles in model._handles, and a
+    dictionary with the matrix variable of each block
+    """
+    model = gb.Model('MILP')
+    variables = {}
+    for variable in formulation["variables"]:
+        variables[variable["name"]] = model.addMVar(variable["shape"], lb=0, name=variable_names(variable),
+                                                    vtype=gb.GRB.BINARY if variable["binary"] else gb.GRB.CONTINUOUS)
+    for constraint in formulation["constraints"]:
+        expression = None
+        for name, coefficients in constraint["coefficients"].items():
+            term = coefficients @ variables[name].reshape(-1)
+            expression = term if expression is None else expression + term
+        model.addConstr(expression >= constraint["rhs"], name=constraint_names(constraint))
+    objective = None
+    for name, coefficients in formulation["objective"].items():
+        term = coefficients @ variables[name].reshape(-1)
+        objective = term if objective is None else objective + term
+    model.setObjective(objective, gb.GRB.MAXIMIZE)
+    model.update()
+    model._handles = get_handles(variables)
+    return model, variables
+
+
+def build_gurobi_risk_model(scenarios, revenues, probabilities, capacity, penalty, formulation="scenario"):
+    """
+    Builds a gurobi model of a problem instance that is reused for the EV model and every CVaR risk level and beta.
+    It always has the CVaR variables and constraints, which do not depend on the risk or beta; the EV model is the
+    CVaR model with zero objective coefficients for eta and sw. Changing the risk or beta with
+    solve_gurobi_risk_model only changes objective coefficients. The EV files and output leave out the CVaR part
+    (get_cvar_indices), so they match those of a separate EV model up to the last digit of the objective and, since
+    each solve starts from the previous solution, the choice between equally good solutions.
+    :param scenarios: the (scenarios x items) size matrix
+    :param revenues: the revenue of each item
+    :param probabilities: the probability vector of the scenarios
+    :param capacity: the capacity of the knapsack
+    :param penalty: the penalty per size unit
+    :param formulation: scenario or first_stage
+    :return: dictionary with the model, its variable blocks and its formulation data
+    """
+    data = get_formulation(scenarios, revenues, probabilities, capacity, penalty, 0, formulation=formulation, cvar=True)
+    model, variables = build_gurobi_model(data)
+    return {"model": model, "variables": variables, "formulation": data}
+
+
+def solve_gurobi_risk_model(risk_model, risk, beta=None):
+    """
+    Sets the objective of the model of build_gurobi_risk_model to the given risk and beta and optimizes it. The
+    solution of the previous solve, which stays feasible since the constraints do not change, is the MIP start.
+    :param risk_model: the dictionary of build_gurobi_risk_model
+    :param risk: model risk, 0 for the EV model
+    :param beta: beta param of the CVaR model
+    :return: the optimized model
+    """
+    model, variables, data = risk_model["model"], risk_model["variables"], risk_model["formulation"]
+    if model.SolCount > 0:
+        for variable in variables.values():
+            variable.Start = variable.X
+    objective = get_objective(data["expected_revenues"], data["probabilities"], data["penalty"], risk, beta, True)
+    for name, coefficients in objective.items():
+        variables[name].Obj = coefficients.reshape(variables[name].shape)
+    model.optimize()
+    return model
+
+
+def get_cvar_indices(model):
+    """
+    The CVaR part of a model: the eta and sw variables and the constraints that use them. The EV solves of a
+    model of build_gurobi_risk_model leave it unused, and it is left out of their files and output.
+    :param model: a gurobi model with variable handles (model._handles)
+    :return: the indices of the CVaR variables and constraints, None if the model has no CVaR variables
+    """
+    if model._handles["eta"] is None:
+        return None
+    variables = [variable.index for name in ("eta", "sw") for variable in model._handles[name].tolist()]
+    constraints = np.unique(model.getA()[:, variables].nonzero()[0])
+    return variables, constraints.tolist()
+
+
+def get_handles(blocks):
+    """
+    :param blocks: dictionary with the variables (or the values) of each block of the formulation
+    :return: dictionary with the decision, tu, sw and eta handles of the blocks, sw and eta are None in EV models
+    """
+    return {"decision": blocks["decision_var"], "tu": blocks["penalty_decision"], "sw": blocks.get("sw"),
+            "eta": blocks.get("eta")}
+
+
+def get_highs_problem(formulation):
+    """
+    Assembles the formulation into the single variable vector, constraint matrix and bounds of
+    scipy.optimize.milp, with the variable blocks in the order of the formulation
+    :param formulation: the formulation data of get_formulation
+    :return: dictionary with the milp arguments (c, integrality, bounds, constraints) and the block offsets
+    """
+    offsets, sizes = {}, {}
+    num_variables = 0
+    for variable in formulation["variables"]:
+        offsets[variable["name"]] = num_variables
+        sizes[variable["name"]] = int(np.prod(variable["shape"]))
+        num_variables += sizes[variable["name"]]
+    integrality = np.zeros(num_variables)
+    upper = np.full(num_variables, np.inf)
+    for variable in formulation["variables"]:
+        if variable["binary"]:
+            block = slice(offsets[variable["name"]], offsets[variable["name"]] + sizes[variable["name"]])
+            integrality[block] = 1
+            upper[block] = 1
+    c = np.zeros(num_variables)
+    for name, coefficients in formulation["objective"].items():
+        c[offsets[name]:offsets[name] + sizes[name]] = coefficients
+    rows = []
+    for constraint in formulation["constraints"]:
+        blocks = [constraint["coefficients"].get(variable["name"],
+                                                 sparse.csr_matrix((len(constraint["rhs"]), sizes[variable["name"]])))
+                  for variable in formulation["variables"]]
+        rows.append(sparse.hstack(blocks, format="csr"))
+    matrix = sparse.vstack(rows, format="csr")
+    rhs = np.concatenate([constraint["rhs"] for constraint in formulation["constraints"]])
+    # milp minimizes
+    return {"c": -c, "integrality": integrality, "bounds": optimize.Bounds(np.zeros(num_variables), upper),
+            "constraints": optimize.LinearConstraint(matrix, rhs, np.inf), "offsets": offsets}
+
+
+def solve_with_highs(formulation, time_limit=None, problem=None):
+    """
+    HiGHS backend, through scipy.optimize.milp, it needs no license
+    :param formulation: the formulation data of get_formulation
+    :param time_limit: the time limit in seconds, None for no limit
+    :param problem: the result of get_highs_problem for the formulation, built here if None
+    :return: dictionary with the status (optimal, limit, infeasible, unbounded or other), the objective value and
+    the values of each variable block
+    """
+    problem = get_highs_problem(formulation) if problem is None else problem
+    options = {} if time_limit is None else {"time_limit": time_limit}
+    result = optimize.milp(problem["c"], integrality=problem["integrality"], bounds=problem["bounds"],
+                           constraints=problem["constraints"], options=options)
+    solution = {"status": highs_statuses.get(result.status, "other"), "message": result.message,
+                "objective": None, "values": {}}
+    if result.x is not None:
+        solution["objective"] = -result.fun
+        for variable in formulation["variables"]:
+            offset = problem["offsets"][variable["name"]]
+            solution["values"][variable["name"]] = \
+                result.x[offset:offset + int(np.prod(variable["shape"]))].reshape(variable["shape"])
+    return solution
+
+
+def get_solution_text(formulation, solution, model_name="MILP"):
+    """
+    The solution in the format of the Gurobi .sol files
+    :param formulation: the formulation data of get_formulation
+    :param solution: the solution of solve_with_highs
+    :param model_name: the model name of the header
+    :return: the content of the .sol file
+    """
+    names = [name for variable in formulation["variables"] for name in variable_names(variable).ravel().tolist()]
+    values = [value for variable in formulation["variables"]
+              for value in solution["values"][variable["name"]].ravel().tolist()]
+    return format_solution(model_name, solution["objective"], names, values)
+
+
+def format_solution(model_name, objective, names, values):
+    """
+    Formats a solution as Gurobi writes its .sol files
+    :param model_name: the model name of the header
+    :param objective: the objective value
+    :param names: the variable names
+    :param values: the variable values
+    :return: the content of the .sol file
+    """
+    lines = ["# Solution for model {}".format(model_name), "# Objective value = {}".format(format_number(objective))]
+    lines.extend("{} {}".format(name, format_number(value)) for name, value in zip(names, values))
+    return "\n".join(lines) + "\n"
+
+
+def format_number(value):
+    """
+    :return: the value with 15 significant digits, or with 17 if 15 do not give back the same number, and -0 as 0
+    """
+    value = value + 0.0
+    text = "{:.15g}".format(value)
+    return text if float(text) == value else "{:.16e}".format(value)